@@ -0,0 +1,45 @@
+import argparse
+import json
+
+from utils.Benchmark import BenchmarkHarness, SanitizerBenchmark
+
+"""
+Offline load test. Drives the bot with synthetic discord messages and stub g4f providers, no network required.
+With --sanitizer, times the mention and response sanitization on messages with many mentions instead.
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs an offline load test and prints a json report.")
+    parser.add_argument("--messages", type=int, default=200, help="Number of messages to send")
+    parser.add_argument("--guilds", type=int, default=10, help="Number of guilds the messages are spread over")
+    parser.add_argument("--users", type=int, default=20, help="Number of distinct message authors")
+    parser.add_argument("--rate", type=float, default=50.0, help="Average messages per second, 0 sends all at once")
+    parser.add_argument("--providers", type=int, default=6, help="Number of stub providers")
+    parser.add_argument("--latency", type=float, default=0.5, help="Median latency of the fastest stub provider")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of provider latency")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="Chance that a provider call raises")
+    parser.add_argument("--invalid-rate", type=float, default=0.05, help="Chance of an invalid provider response")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json", help="Storage backend")
+    parser.add_argument("--stream", action="store_true", help="Stream responses")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure peak memory with tracemalloc")
+    parser.add_argument("--sanitizer", action="store_true",
+                        help="Runs the mention sanitization micro-benchmark instead of the load test")
+    parser.add_argument("--mentions", type=int, default=20, help="Mentions per message in the sanitizer benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", type=str, default=None, help="Writes the report to this file")
+    args = parser.parse_args()
+
+    if args.sanitizer:
+        harness = SanitizerBenchmark(messages=args.messages, mentions=args.mentions, guilds=args.guilds,
+                                     users_per_guild=args.users, seed=args.seed)
+    else:
+        harness = BenchmarkHarness(messages=args.messages, guilds=args.guilds, users_per_guild=args.users,
+                                   arrival_rate=args.rate, providers=args.providers, median_latency=args.latency,
+                                   latency_sigma=args.latency_sigma, failure_rate=args.failure_rate,
+                                   invalid_rate=args.invalid_rate, storage_backend=args.storage,
+                                   stream_responses=args.stream, trace_memory=args.trace_memory, seed=args.seed)
+    report = json.dumps(harness.run(), indent=4)
+    print(report)
+    if args.output is not None:
+        with open(args.output, "w") as report_file:
+            report_file.write(report)
@@ -1,5 +1,12 @@
-import g4f
-from utils.Bot import DiscordBot
+import time
+PROCESS_START_TIME = time.perf_counter()
+
+from utils.Bot import DiscordBot, BotDataManager
+from utils.Latency import HumanizedLatencyPolicy
+from utils.Summarizer import ConversationSummarizer
+from utils.InferencePool import start_inference_workers
+from utils.Admission import AdmissionController
+import multiprocessing
 import os
 from dotenv import load_dotenv
 
@@ -7,9 +14,14 @@ from dotenv import load_dotenv
 Discord Developer Portal: https://discord.com/developers/applications
 """
 
-if __name__ == "__main__":
-    print("g4f Package Version: ", g4f.version)
 
+# Instantiates and Runs Discord Bot
+def run_gateway(BOT_TOKEN: str, OWNER_USER_ID: int, bot_options: dict):
+    Discord_Bot = DiscordBot(BOT_TOKEN, OWNER_USER_ID, process_start_time=PROCESS_START_TIME, **bot_options)
+    Discord_Bot.run()
+
+
+if __name__ == "__main__":
     # Load environment variables from .env
     load_dotenv()
 
@@ -18,7 +30,52 @@ if __name__ == "__main__":
     OWNER_USER_ID = int(os.getenv("OWNER_USER_ID"))
     # (Optional)
     BOT_JOIN_URL = os.getenv("BOT_JOIN_URL")
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # "json" or "sqlite"
+    STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() == "true"
+    HUMANIZED_LATENCY = os.getenv("HUMANIZED_LATENCY", "true").lower() == "true"
+    METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+    METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL")) if os.getenv("RESPONSE_CACHE_TTL") else None
+    SUMMARIZE_HISTORY = os.getenv("SUMMARIZE_HISTORY", "true").lower() == "true"
+    GATEWAY_PROCESSES = int(os.getenv("GATEWAY_PROCESSES", "1"))
+    SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+    INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+    MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", str(AdmissionController.DEFAULT_MAX_QUEUE_DEPTH)))
+    MESSAGE_DEADLINE = float(os.getenv("MESSAGE_DEADLINE", str(AdmissionController.DEFAULT_DEADLINE)))
+    BUSY_REACTION = os.getenv("BUSY_REACTION")
 
-    # Instantiates and Runs Discord Bot
-    Discord_Bot = DiscordBot(BOT_TOKEN, OWNER_USER_ID)
-    Discord_Bot.run()
+    bot_options = dict(storage_backend=STORAGE_BACKEND,
+                       stream_responses=STREAM_RESPONSES,
+                       min_response_time=HumanizedLatencyPolicy.DEFAULT_MIN_RESPONSE_TIME if HUMANIZED_LATENCY else None,
+                       metrics_port=METRICS_PORT, metrics_sample_rate=METRICS_SAMPLE_RATE,
+                       response_cache_ttl=RESPONSE_CACHE_TTL,
+                       summary_idle_delay=ConversationSummarizer.DEFAULT_IDLE_DELAY if SUMMARIZE_HISTORY else None,
+                       max_queue_depth=MAX_QUEUE_DEPTH, message_deadline=MESSAGE_DEADLINE, busy_reaction=BUSY_REACTION)
+
+    # Provider requests can be handed to a pool of inference worker processes
+    if INFERENCE_WORKERS > 0:
+        os.makedirs(BotDataManager.DEFAULT_BOT_DIRECTIVES_PATH, exist_ok=True)
+        _, bot_options["inference_addresses"] = start_inference_workers(
+            INFERENCE_WORKERS, BotDataManager.DEFAULT_BOT_DIRECTIVES_PATH)
+
+    if GATEWAY_PROCESSES <= 1:
+        if SHARD_COUNT is not None:
+            bot_options["shard_count"] = SHARD_COUNT
+        run_gateway(BOT_TOKEN, OWNER_USER_ID, bot_options)
+    else:
+        # Splits the shards between the gateway processes. Each process gets its own metrics port.
+        shard_count = SHARD_COUNT if SHARD_COUNT is not None else GATEWAY_PROCESSES
+        context = multiprocessing.get_context("spawn")
+        gateways = []
+        for index in range(min(GATEWAY_PROCESSES, shard_count)):
+            gateway_options = dict(bot_options, shard_count=shard_count,
+                                   shard_ids=list(range(index, shard_count, GATEWAY_PROCESSES)),
+                                   process_name=f"gateway_{index}")
+            if METRICS_PORT is not None:
+                gateway_options["metrics_port"] = METRICS_PORT + index
+            gateway = context.Process(target=run_gateway, name=f"gateway-{index}",
+                                      args=(BOT_TOKEN, OWNER_USER_ID, gateway_options))
+            gateway.start()
+            gateways.append(gateway)
+        for gateway in gateways:
+            gateway.join()
@@ -0,0 +1,89 @@
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        # Refills rate tokens per second, up to capacity
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_update = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+    def peek(self) -> bool:
+        self.refill()
+        return self.tokens >= 1.0
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def is_full(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    DEFAULT_MAX_QUEUE_DEPTH = 200  # Messages waiting across all conversations
+    DEFAULT_GUILD_RATE = 1.0  # Messages per second a guild may queue once its burst is used up
+    DEFAULT_GUILD_BURST = 10
+    DEFAULT_USER_RATE = 0.25  # Messages per second a user may queue once their burst is used up
+    DEFAULT_USER_BURST = 4
+    DEFAULT_DEADLINE = 60.0  # Seconds after which a queued message is not worth answering anymore
+    MAX_BUCKETS = 10000  # Idle buckets are pruned once there are more than this
+
+    REJECT_QUEUE_FULL = "queue_full"
+    REJECT_GUILD_RATE = "guild_rate"
+    REJECT_USER_RATE = "user_rate"
+
+    def __init__(self, max_queue_depth: int = DEFAULT_MAX_QUEUE_DEPTH,
+                 guild_rate: float = DEFAULT_GUILD_RATE, guild_burst: int = DEFAULT_GUILD_BURST,
+                 user_rate: float = DEFAULT_USER_RATE, user_burst: int = DEFAULT_USER_BURST,
+                 deadline: Optional[float] = DEFAULT_DEADLINE):
+        self.max_queue_depth = max_queue_depth
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.deadline = deadline
+        # TGuild_ID(int) / TUser_ID(int): TokenBucket
+        self.guild_buckets: Dict[int, TokenBucket] = {}
+        self.user_buckets: Dict[int, TokenBucket] = {}
+
+    def admit(self, guild_id: Optional[int], user_id: int, queue_depth: int) -> Optional[str]:
+        # Returns None if the message may be queued, otherwise the reason it was rejected.
+        # Tokens are only taken when every check passes, so a rejected message costs nothing.
+        # DMs (guild_id None) are only limited per user, they do not share a guild bucket.
+        if queue_depth >= self.max_queue_depth:
+            return AdmissionController.REJECT_QUEUE_FULL
+        guild_bucket = None
+        if guild_id is not None:
+            guild_bucket = self._get_bucket(self.guild_buckets, guild_id, self.guild_rate, self.guild_burst)
+            if not guild_bucket.peek():
+                return AdmissionController.REJECT_GUILD_RATE
+        user_bucket = self._get_bucket(self.user_buckets, user_id, self.user_rate, self.user_burst)
+        if not user_bucket.peek():
+            return AdmissionController.REJECT_USER_RATE
+        if guild_bucket is not None:
+            guild_bucket.take()
+        user_bucket.take()
+        return None
+
+    # Whether a message queued at enqueue_time (perf_counter) has waited past the deadline
+    def is_expired(self, enqueue_time: float) -> bool:
+        return self.deadline is not None and time.perf_counter() - enqueue_time > self.deadline
+
+    def _get_bucket(self, buckets: Dict[int, TokenBucket], key: Optional[int], rate: float,
+                    capacity: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= AdmissionController.MAX_BUCKETS:
+                # Full buckets behave exactly like new ones, so they can be dropped
+                for idle_key in [idle_key for idle_key, idle_bucket in buckets.items() if idle_bucket.is_full()]:
+                    del buckets[idle_key]
+            bucket = buckets[key] = TokenBucket(rate, capacity)
+        return bucket
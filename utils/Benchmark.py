@@ -0,0 +1,417 @@
+import asyncio
+import datetime
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from itertools import count
+from typing import List, Optional
+
+from utils.Admission import AdmissionController
+from utils.Bot import DiscordBot
+from utils.Sanitizer import TextSanitizer
+
+
+# ========================================= #
+#            Stub g4f Providers
+# ========================================= #
+
+def create_stub_provider(name: str, median_latency: float, latency_sigma: float = 0.5, failure_rate: float = 0.0,
+                         invalid_rate: float = 0.0, seed: Optional[int] = None):
+    # Creates a class that behaves like a g4f provider. Latencies follow a log-normal distribution around the median.
+    rng = random.Random(seed)
+
+    async def respond(messages: List[dict]) -> str:
+        await asyncio.sleep(median_latency * rng.lognormvariate(0.0, latency_sigma))
+        roll = rng.random()
+        if roll < failure_rate:
+            raise ConnectionError(f"{name} stub failure")
+        if roll < failure_rate + invalid_rate:
+            return "Sorry, your app version is outdated."
+        return f"[{name}]: You said {len(messages[-1]['content'])} characters. " + "Lorem ipsum dolor sit amet. " * 4
+
+    async def create_async(cls, model: str, messages: List[dict], **kwargs) -> str:
+        StubProviderCalls.increment()
+        return await respond(messages)
+
+    async def create_async_generator(cls, model: str, messages: List[dict], **kwargs):
+        StubProviderCalls.increment()
+        response = await respond(messages)
+        for start in range(0, len(response), 16):
+            await asyncio.sleep(0.01)
+            yield response[start:start + 16]
+
+    return type(name, (), {
+        "working": True,
+        "supports_stream": True,
+        "create_async": classmethod(create_async),
+        "create_async_generator": classmethod(create_async_generator),
+    })
+
+
+class StubProviderCalls:
+    calls = 0
+
+    @staticmethod
+    def increment():
+        StubProviderCalls.calls += 1
+
+
+# ========================================= #
+#            Fake Discord Gateway
+# ========================================= #
+
+class FakeUser:
+    def __init__(self, user_id: int, display_name: str, bot: bool = False):
+        self.id = user_id
+        self.display_name = display_name
+        self.name = display_name
+        self.bot = bot
+        self.roles = []
+
+    def mentioned_in(self, message) -> bool:
+        return any(mention.id == self.id for mention in message.mentions)
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        return FakeSentMessage(content)
+
+
+async def fake_change_presence(**kwargs):
+    pass
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, owner_id: int = 0):
+        self.id = guild_id
+        self.owner_id = owner_id
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSentMessage:
+    def __init__(self, content: Optional[str]):
+        self.content = content
+
+    async def edit(self, content: Optional[str] = None, **kwargs):
+        self.content = content
+
+    async def delete(self):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: FakeGuild, harness: "BenchmarkHarness"):
+        self.id = channel_id
+        self.guild = guild
+        self.harness = harness
+
+    def typing(self) -> FakeTyping:
+        return FakeTyping()
+
+    async def send(self, content: Optional[str] = None, reference=None, **kwargs):
+        self.harness.record_reply(reference)
+        return FakeSentMessage(content)
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, content: str, author: FakeUser, channel: FakeChannel, mentions: list):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.mentions = mentions
+        self.stickers = []
+        self.attachments = []
+        self.reference = None
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+# ========================================= #
+#              Benchmark Runner
+# ========================================= #
+
+class BenchmarkHarness:
+    BOT_USER_ID = 1
+
+    def __init__(self, messages: int = 200, guilds: int = 10, users_per_guild: int = 20, arrival_rate: float = 50.0,
+                 providers: int = 6, median_latency: float = 0.5, latency_sigma: float = 0.5,
+                 failure_rate: float = 0.1, invalid_rate: float = 0.05, storage_backend: str = "json",
+                 stream_responses: bool = False, trace_memory: bool = False, timeout: float = 300.0,
+                 seed: int = 0):
+        self.message_count = messages
+        self.guild_count = guilds
+        self.users_per_guild = users_per_guild
+        self.arrival_rate = arrival_rate
+        self.provider_count = providers
+        self.median_latency = median_latency
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.invalid_rate = invalid_rate
+        self.storage_backend = storage_backend
+        self.stream_responses = stream_responses
+        self.trace_memory = trace_memory
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.seed = seed
+
+        # TMessage_ID(int): perf_counter time the message reached on_message
+        self.received_at = {}
+        self.latencies = []
+        self.replied = set()
+        # TMessage_ID(int): ids of the messages answered together with it
+        self.batches = {}
+        self.processed = 0
+        self.stats_lock = threading.Lock()
+        self.tokenizer_cpu_time = 0.0
+        self.persistence_io_time = 0.0
+        self.persistence_writes = 0
+
+    def record_reply(self, reference):
+        # Called by the fake channels. The first reply to a message completes it and the messages coalesced with it.
+        if reference is None or reference.id in self.replied or reference.id not in self.received_at:
+            return
+        for message_id in self.batches.pop(reference.id, [reference.id]):
+            self.replied.add(message_id)
+            self.latencies.append(time.perf_counter() - self.received_at[message_id])
+
+    def create_bot(self, directives_path: str) -> DiscordBot:
+        bot = DiscordBot("benchmark", 0, bot_directives_path=directives_path, storage_backend=self.storage_backend,
+                         stream_responses=self.stream_responses, min_response_time=None,
+                         provider_probe_interval=None)
+        bot.LLM.providers = [
+            create_stub_provider(f"StubProvider{index}", self.median_latency * (1 + index * 0.25), self.latency_sigma,
+                                 self.failure_rate, self.invalid_rate, seed=self.seed + index)
+            for index in range(self.provider_count)]
+        bot.client._connection.user = FakeUser(BenchmarkHarness.BOT_USER_ID, "AuroraGlazed", bot=True)
+        # There is no gateway connection to update the presence on
+        bot.client.change_presence = fake_change_presence
+        # Admits every message, the load test measures answering them rather than shedding them
+        bot.admission = AdmissionController(max_queue_depth=self.message_count + 1, guild_burst=self.message_count,
+                                            user_burst=self.message_count, deadline=None)
+        bot.setup()
+        self.instrument(bot)
+        return bot
+
+    def instrument(self, bot: DiscordBot):
+        # Measures the CPU time spent tokenizing, on whichever thread it runs
+        count_tokens = bot.LLM.count_tokens
+
+        def timed_count_tokens(text: str) -> int:
+            start_time = time.thread_time()
+            result = count_tokens(text)
+            with self.stats_lock:
+                self.tokenizer_cpu_time += time.thread_time() - start_time
+            return result
+        bot.LLM.count_tokens = timed_count_tokens
+
+        # Measures the time spent in the storage backend
+        storage = bot.Data.storage.storage
+        for method_name in ("save_messages", "save_metadata"):
+            setattr(storage, method_name, self.timed_storage_call(getattr(storage, method_name)))
+
+        # Counts processed messages, whether or not a reply could be generated
+        process_queued_messages = bot.process_queued_messages
+
+        async def counted_process_queued_messages(messages):
+            self.batches[messages[-1].id] = [message.id for message in messages]
+            try:
+                await process_queued_messages(messages)
+            finally:
+                self.processed += len(messages)
+        bot.processing_queue.handler = counted_process_queued_messages
+
+    def timed_storage_call(self, method):
+        def timed_method(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with self.stats_lock:
+                    self.persistence_io_time += time.perf_counter() - start_time
+                    self.persistence_writes += 1
+        return timed_method
+
+    def create_messages(self) -> List[FakeMessage]:
+        bot_user = FakeUser(BenchmarkHarness.BOT_USER_ID, "AuroraGlazed", bot=True)
+        users = [FakeUser(1000 + index, f"user_{index}") for index in range(self.users_per_guild)]
+        channels = [FakeChannel(500 + index, FakeGuild(100 + index), self) for index in range(self.guild_count)]
+        message_ids = count(10000)
+
+        messages = []
+        for _ in range(self.message_count):
+            author = self.rng.choice(users)
+            mentions = [bot_user] + self.rng.sample(users, k=min(2, len(users)))
+            content = f"<@{bot_user.id}> " + " ".join(f"<@{user.id}>" for user in mentions[1:]) + \
+                " hey, what do you think about " + " ".join(self.rng.choice(
+                    ["games", "music", "the weather", "homework", "pizza", "discord", "movies"]) for _ in range(5))
+            messages.append(FakeMessage(next(message_ids), content, author, self.rng.choice(channels), mentions))
+        return messages
+
+    async def drive(self, bot: DiscordBot) -> float:
+        await bot.client.on_ready()
+        messages = self.create_messages()
+        start_time = time.perf_counter()
+        for message in messages:
+            message.created_at = datetime.datetime.now(datetime.timezone.utc)
+            self.received_at[message.id] = time.perf_counter()
+            await bot.client.on_message(message)
+            if self.arrival_rate > 0:
+                await asyncio.sleep(self.rng.expovariate(self.arrival_rate))
+
+        # Waits for every admitted message to be processed
+        deadline = time.perf_counter() + self.timeout
+        while time.perf_counter() < deadline:
+            if bot.processing_queue.queue_depth() == 0 and self.processed >= self.admitted(bot):
+                break
+            await asyncio.sleep(0.01)
+        duration = time.perf_counter() - start_time
+
+        await bot.processing_queue.stop()
+        await bot.Data.flush()
+        return duration
+
+    def admitted(self, bot: DiscordBot) -> int:
+        return bot.processing_queue.submitted_count
+
+    def run(self) -> dict:
+        directives_path = tempfile.mkdtemp(prefix="aurora_benchmark_")
+        StubProviderCalls.calls = 0
+        if self.trace_memory:
+            tracemalloc.start()
+        try:
+            bot = self.create_bot(directives_path)
+            duration = asyncio.run(self.drive(bot))
+            bot.Data.close()
+            peak_traced_memory = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        finally:
+            if self.trace_memory:
+                tracemalloc.stop()
+            shutil.rmtree(directives_path, ignore_errors=True)
+
+        return self.report(bot, duration, peak_traced_memory)
+
+    def report(self, bot: DiscordBot, duration: float, peak_traced_memory: Optional[int]) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(value: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(round(value / 100.0 * (len(latencies) - 1))))]
+
+        return {
+            "config": {
+                "messages": self.message_count,
+                "guilds": self.guild_count,
+                "users_per_guild": self.users_per_guild,
+                "arrival_rate": self.arrival_rate,
+                "providers": self.provider_count,
+                "median_latency": self.median_latency,
+                "latency_sigma": self.latency_sigma,
+                "failure_rate": self.failure_rate,
+                "invalid_rate": self.invalid_rate,
+                "storage_backend": self.storage_backend,
+                "stream_responses": self.stream_responses,
+                "seed": self.seed,
+            },
+            "messages_sent": self.message_count,
+            "messages_admitted": self.admitted(bot),
+            "replies": len(latencies),
+            "duration_seconds": duration,
+            "throughput_replies_per_second": len(latencies) / duration if duration > 0 else 0.0,
+            "latency_seconds": {
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "provider_calls": StubProviderCalls.calls,
+            "tokenizer_cpu_seconds": self.tokenizer_cpu_time,
+            "persistence_io_seconds": self.persistence_io_time,
+            "persistence_writes": self.persistence_writes,
+            "peak_traced_memory_bytes": peak_traced_memory,
+            "max_rss_kilobytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+# ========================================= #
+#          Sanitization Micro-Benchmark
+# ========================================= #
+
+class SanitizerBenchmark:
+    BOT_USER_ID = 1
+    RESPONSE_TEMPLATE = "[AuroraGlazed]: honestly {mentions} you should all try the pizza place downtown"
+
+    def __init__(self, messages: int = 2000, mentions: int = 20, guilds: int = 10, users_per_guild: int = 50,
+                 seed: int = 0):
+        self.message_count = messages
+        self.mention_count = mentions
+        self.guild_count = guilds
+        self.users_per_guild = users_per_guild
+        self.rng = random.Random(seed)
+        self.seed = seed
+
+    def create_messages(self) -> List[FakeMessage]:
+        # Every message mentions the bot and many members, some of them more than once
+        bot_user = FakeUser(SanitizerBenchmark.BOT_USER_ID, "AuroraGlazed", bot=True)
+        users = [FakeUser(1000 + index, f"user {index} ✨") for index in range(self.users_per_guild)]
+        channels = [FakeChannel(500 + index, FakeGuild(100 + index), None) for index in range(self.guild_count)]
+        message_ids = count(10000)
+
+        messages = []
+        for _ in range(self.message_count):
+            mentioned = [self.rng.choice(users) for _ in range(self.mention_count)]
+            content = f"<@{bot_user.id}> " + " and ".join(f"<@{user.id}>" for user in mentioned) + " pizza tonight?"
+            mentions = [bot_user] + list({user.id: user for user in mentioned}.values())
+            messages.append(FakeMessage(next(message_ids), content, self.rng.choice(users),
+                                        self.rng.choice(channels), mentions))
+        return messages
+
+    def run(self) -> dict:
+        sanitizer = TextSanitizer()
+        messages = self.create_messages()
+        responses = [SanitizerBenchmark.RESPONSE_TEMPLATE.format(
+            mentions=" ".join(f"<@user_{index}>" for index in range(self.mention_count)))] * self.message_count
+
+        def sanitize_inbound():
+            start_time = time.perf_counter()
+            for message in messages:
+                guild_id = TextSanitizer.get_guild_id(message)
+                sanitizer.get_display_name(guild_id, message.author)
+                sanitizer.sanitize_message_content(message.content, message.mentions, guild_id,
+                                                   SanitizerBenchmark.BOT_USER_ID)
+            return time.perf_counter() - start_time
+
+        # The first pass fills the display name cache, the second one reads from it
+        cold_time = sanitize_inbound()
+        warm_time = sanitize_inbound()
+        start_time = time.perf_counter()
+        for response in responses:
+            TextSanitizer.sanitize_bot_response(response)
+        outbound_time = time.perf_counter() - start_time
+
+        return {
+            "config": {
+                "messages": self.message_count,
+                "mentions_per_message": self.mention_count,
+                "guilds": self.guild_count,
+                "users_per_guild": self.users_per_guild,
+                "seed": self.seed,
+            },
+            "inbound_cold_microseconds_per_message": cold_time / self.message_count * 1e6,
+            "inbound_warm_microseconds_per_message": warm_time / self.message_count * 1e6,
+            "outbound_microseconds_per_response": outbound_time / self.message_count * 1e6,
+            "cached_display_names": sum(len(names) for names in sanitizer.display_names.values()),
+        }
@@ -1,15 +1,33 @@
-import re
-from typing import Optional, List
+import io
+from typing import Optional, List, Tuple, Callable, Awaitable
 
 import discord
 from discord.ext import commands
 import os
-import json
 import asyncio
-from queue import SimpleQueue
-import random
+import signal
+import time
 
 from utils.LLM import LLM
+from utils.Streaming import ProgressiveMessage
+from utils.Latency import HumanizedLatencyPolicy
+from utils.Scheduler import ConversationScheduler
+from utils.Storage import StorageBackend, JsonStorageBackend, SQLiteStorageBackend
+from utils.Persistence import WriteBehindStorage
+from utils.ServerState import ServerState, ServerStateCache
+from utils.Metrics import Metrics
+from utils.ResponseCache import ResponseCache
+from utils.Summarizer import ConversationSummarizer
+from utils.Knowledge import KnowledgeIndex
+from utils.InferencePool import InferenceClient, RemoteLLM
+from utils.Admission import AdmissionController
+from utils.Roles import RoleStore
+from utils.Chunking import split_response
+from utils.Prober import ProviderProber
+from utils.Outbound import OutboundQueue
+from utils.Routing import RoutingTable
+from utils.Ingestion import AttachmentIngestor, IngestionError
+from utils.Sanitizer import TextSanitizer
 
 
 class BotDataManager:
@@ -18,22 +36,26 @@ class BotDataManager:
     DEFAULT_BOT_DIRECTIVES_PATH = "bot_directives"
     SERVER_DATA_FILE_PATH = "server_data"
     ROLES_FILES_PATH = "roles"
+    KNOWLEDGE_FILES_PATH = "knowledge"
+    INCOMING_FILES_PATH = "incoming"
     DEFAULT_ROLE_FILE_NAME = "default_role.txt"
 
-    MESSAGE_CACHE_FILE_NAME = "message_cache.json"
-    METADATA_FILE_NAME = "metadata.json"
+    MESSAGE_CACHE_FILE_NAME = JsonStorageBackend.MESSAGE_CACHE_FILE_NAME
+    METADATA_FILE_NAME = JsonStorageBackend.METADATA_FILE_NAME
 
-    def __init__(self, bot_directives_path: str = DEFAULT_BOT_DIRECTIVES_PATH):
-        # TServer_ID(str): {"role": "default_role.txt", ...}(dict)
-        self.metadata = {}
-        # TServer_ID(str): [{"role": "user", "content": ""},{...},...](list)
-        self.messages = {}
-        # TServer_ID(str): system message(str)
-        self.roles = {}
+    STORAGE_JSON = "json"
+    STORAGE_SQLITE = "sqlite"
+
+    def __init__(self, bot_directives_path: str = DEFAULT_BOT_DIRECTIVES_PATH, storage_backend: str = STORAGE_JSON,
+                 persistence_flush_window: float = WriteBehindStorage.DEFAULT_FLUSH_WINDOW,
+                 max_cached_servers: int = ServerStateCache.DEFAULT_MAX_ENTRIES,
+                 max_cached_bytes: int = ServerStateCache.DEFAULT_MAX_BYTES,
+                 server_idle_ttl: float = ServerStateCache.DEFAULT_IDLE_TTL,
+                 metrics: Optional[Metrics] = None):
 
         # Sets up internal file directory
         if not os.path.exists(bot_directives_path):
-            os.makedirs(BotDataManager.DEFAULT_BOT_DIRECTIVES_PATH)
+            os.makedirs(bot_directives_path)
         self.directives_path = bot_directives_path
 
         # Sets up the roles file directory
@@ -46,105 +68,132 @@ class BotDataManager:
             with open(os.path.join(self.roles_data_path, BotDataManager.DEFAULT_ROLE_FILE_NAME), "w") as file:
                 file.write(BotDataManager.DEFAULT_ROLE)
 
+        # Role texts, loaded once and shared by every server that selected them
+        self.roles = RoleStore(self.roles_data_path, BotDataManager.DEFAULT_ROLE_FILE_NAME, BotDataManager.DEFAULT_ROLE)
+        # Uploaded files are downloaded here and moved into place once they are complete
+        self.ingestor = AttachmentIngestor(os.path.join(self.directives_path, BotDataManager.INCOMING_FILES_PATH))
+
+        # Sets up the knowledge documents directory
+        if not os.path.exists(os.path.join(self.directives_path, BotDataManager.KNOWLEDGE_FILES_PATH)):
+            os.makedirs(os.path.join(self.directives_path, BotDataManager.KNOWLEDGE_FILES_PATH))
+        self.knowledge_data_path = os.path.join(self.directives_path, BotDataManager.KNOWLEDGE_FILES_PATH)
+
         # Sets up server data directory
         if not os.path.exists(os.path.join(self.directives_path, BotDataManager.SERVER_DATA_FILE_PATH)):
             os.makedirs(os.path.join(self.directives_path, BotDataManager.SERVER_DATA_FILE_PATH))
         self.server_data_path = os.path.join(self.directives_path, BotDataManager.SERVER_DATA_FILE_PATH)
 
-        # Loads data from file directory
-        self.load_server_data()
+        # Sets up the storage backend. Writes are coalesced and performed in the background.
+        self.storage = WriteBehindStorage(self.create_storage_backend(storage_backend), persistence_flush_window,
+                                          metrics=metrics)
+
+        # TServer_ID(str): ServerState. Loaded from storage on first access, evicted once idle and persisted.
+        self.server_states = ServerStateCache(lambda server_folder: not self.storage.is_dirty(server_folder),
+                                              max_cached_servers, max_cached_bytes, server_idle_ttl)
+
+    def create_storage_backend(self, storage_backend: str) -> StorageBackend:
+        if storage_backend == BotDataManager.STORAGE_JSON:
+            return JsonStorageBackend(self.server_data_path)
+        elif storage_backend == BotDataManager.STORAGE_SQLITE:
+            storage = SQLiteStorageBackend(os.path.join(self.directives_path, SQLiteStorageBackend.DATABASE_FILE_NAME))
+            # Imports the existing json server data the first time the database is used
+            migrated_count = storage.migrate_from(JsonStorageBackend(self.server_data_path))
+            if migrated_count > 0:
+                print(f"[SYSTEM] Migrated {migrated_count} server folders from json to sqlite.")
+            return storage
+        raise ValueError(f"Unknown storage backend \"{storage_backend}\"")
+
+    def get_server_state(self, server_folder: str, create: bool = True) -> Optional[ServerState]:
+        state = self.server_states.get(server_folder)
+        if state is not None:
+            return state
+
+        # Read stored data of the server_folder
+        messages = self.storage.load_messages(server_folder)
+        metadata = self.storage.load_metadata(server_folder)
+        return self.add_server_state(server_folder, messages, metadata, create)
+
+    # Gets the server state like get_server_state, but reads a state that is not cached on a worker thread
+    async def load_server_state(self, server_folder: str, create: bool = True) -> Optional[ServerState]:
+        state = self.server_states.get(server_folder)
+        if state is not None:
+            return state
+
+        messages, metadata = await self.storage.load_async(server_folder)
+        # Another task may have loaded the state in the meantime
+        state = self.server_states.get(server_folder)
+        if state is not None:
+            return state
+        return self.add_server_state(server_folder, messages, metadata, create)
+
+    def add_server_state(self, server_folder: str, messages: Optional[List[dict]], metadata: Optional[dict],
+                         create: bool) -> Optional[ServerState]:
+        if not create and messages is None and metadata is None:
+            return None
 
-    def initialize_default_server_data(self, server_folder: str):
         # Initialize default values if not found
-        if server_folder not in self.metadata:
-            self.metadata[server_folder] = {}
-            self.metadata[server_folder]["selected_role"] = BotDataManager.DEFAULT_ROLE_FILE_NAME
-            self.roles[server_folder] = self.get_role_data(self.metadata[server_folder]["selected_role"])
-        if server_folder not in self.messages:
-            self.messages[server_folder] = []
-
-    def load_server_data(self):
-        for server_folder in os.listdir(self.server_data_path):
-            # Read stored data files within the server_folder
-            for name in os.listdir(os.path.join(self.server_data_path, server_folder)):
-                read_data = None
-                with open(os.path.join(self.server_data_path, server_folder, name), "r") as json_file:
-                    # Read and parse data from the file
-                    try:
-                        read_data = json.load(json_file)
-                    except Exception as e:
-                        print(f"[ERROR] Failed to read in json file \"{name}\" {str(e)}")
-                    finally:
-                        json_file.close()
-
-                    # Updates the data from file
-                    if name == BotDataManager.MESSAGE_CACHE_FILE_NAME:
-                        self.messages[server_folder] = read_data if read_data is not None else []
-                    elif name == BotDataManager.METADATA_FILE_NAME:
-                        self.metadata[server_folder] = read_data if read_data is not None else {}
-                        if "selected_role" not in self.metadata[server_folder]:
-                            self.metadata[server_folder]["selected_role"] = BotDataManager.DEFAULT_ROLE_FILE_NAME
-                        self.roles[server_folder] = self.get_role_data(self.metadata[server_folder]["selected_role"])
-
-            # Initialize default values if not found
-            self.initialize_default_server_data(server_folder)
+        is_new = metadata is None
+        metadata = metadata if metadata is not None else {}
+        if "selected_role" not in metadata:
+            metadata["selected_role"] = BotDataManager.DEFAULT_ROLE_FILE_NAME
+        state = ServerState(messages if messages is not None else [], metadata)
+        self.server_states.put(server_folder, state)
+        if is_new:
+            self.update_metadata_file(server_folder)
+        return state
+
+    def get_messages(self, server_folder: str) -> List[dict]:
+        return self.get_server_state(server_folder).messages
+
+    def set_messages(self, server_folder: str, messages: List[dict]):
+        self.get_server_state(server_folder).messages = messages
+        self.server_states.resize(server_folder)
+
+    # Gets the metadata of the server folder, or None if the server has no stored data
+    def get_metadata(self, server_folder: str) -> Optional[dict]:
+        state = self.get_server_state(server_folder, create=False)
+        return state.metadata if state is not None else None
+
+    # Gets the system message of the server folder
+    def get_role(self, server_folder: str) -> str:
+        return self.roles.get(self.get_server_state(server_folder).metadata["selected_role"])
 
     def get_role_data(self, file_name: str) -> str:
-        # Gets the role string from the file
-        if os.path.exists(os.path.join(self.roles_data_path, file_name)):
-            with open(os.path.join(self.roles_data_path, file_name), "r") as file:
-                return file.read()
-        elif file_name != BotDataManager.DEFAULT_ROLE_FILE_NAME:
-            return self.get_role_data(BotDataManager.DEFAULT_ROLE_FILE_NAME)
-        else:
-            return BotDataManager.DEFAULT_ROLE
+        # Gets the role string of the file, or the default role if it does not exist
+        return self.roles.get(file_name)
 
     def update_metadata_file(self, server_folder: str):
-        # If server folder hasn't been created yet, create one.
-        if not os.path.exists(os.path.join(self.server_data_path, server_folder)):
-            os.mkdir(os.path.join(self.server_data_path, server_folder))
-
-        # Writes metadata to server folder
-        with open(os.path.join(self.server_data_path, server_folder, BotDataManager.METADATA_FILE_NAME),
-                  "w") as json_file:
-            json.dump(self.metadata[server_folder], json_file, indent=4)
-            json_file.close()
-
-    def update_messages_file(self, server_folder: str):
-        # If server folder hasn't been created yet, create one.
-        if not os.path.exists(os.path.join(self.server_data_path, server_folder)):
-            os.mkdir(os.path.join(self.server_data_path, server_folder))
-
-        # Writes messages history to server folder
-        with open(os.path.join(self.server_data_path, server_folder, BotDataManager.MESSAGE_CACHE_FILE_NAME),
-                  "w") as json_file:
-            json.dump(self.messages[server_folder], json_file, indent=4)
-            json_file.close()
-
-    def init_source_server_folder(self, server_folder: str):
-        # Initializes variables
-        if server_folder not in self.messages:
-            self.messages[server_folder] = []
-        if server_folder not in self.metadata:
-            self.metadata[server_folder] = {}
-            self.metadata[server_folder]["selected_role"] = BotDataManager.DEFAULT_ROLE_FILE_NAME
-            self.roles[server_folder] = self.get_role_data(self.metadata[server_folder]["selected_role"])
-            self.update_metadata_file(server_folder)
+        # Writes metadata of the server folder
+        self.storage.save_metadata(server_folder, self.get_server_state(server_folder).metadata)
+
+    def update_messages_file(self, server_folder: str, appended: Optional[List[dict]] = None):
+        # Writes messages history of the server folder. Pass the new messages when the history was only appended to.
+        self.storage.save_messages(server_folder, self.get_server_state(server_folder).messages, appended)
+
+    async def flush(self):
+        # Writes all pending data to disk now
+        await self.storage.flush()
+
+    def close(self):
+        # Writes all pending data and releases the storage. Called once the event loop has stopped.
+        self.storage.close()
+
+    async def init_source_server_folder(self, server_folder: str):
+        # Loads or initializes the data of the server folder
+        await self.load_server_state(server_folder)
 
     def switch_selected_role(self, server_folder: str, role_file: str):
-        if server_folder not in self.metadata:
-            self.metadata[server_folder] = {}
+        state = self.get_server_state(server_folder)
 
         # Updates role based on the file
         if not role_file.endswith(".txt"):
             role_file = role_file + ".txt"
-        if os.path.exists(os.path.join(self.roles_data_path, role_file)):
+        if role_file in self.roles:
             # Check if the role file has already been selected.
-            if role_file == self.metadata[server_folder]["selected_role"]:
+            if role_file == state.metadata["selected_role"]:
                 return True
 
-            self.metadata[server_folder]["selected_role"] = role_file
-            self.roles[server_folder] = self.get_role_data(self.metadata[server_folder]["selected_role"])
+            state.metadata["selected_role"] = role_file
             self.update_metadata_file(server_folder)
         else:
             return False
@@ -154,7 +203,7 @@ class BotDataManager:
 
     # Gets list of available roles
     def get_list_of_roles(self) -> List[str]:
-        return os.listdir(self.roles_data_path)
+        return self.roles.list_roles()
 
     # DiscordBot Integration
     def message_source_to_server_folder(self, message: discord.Message) -> str:
@@ -164,137 +213,368 @@ class BotDataManager:
         else:
             return "guild_" + str(message.guild.id)
 
-    def download_personality_from_attachment(self, attachment: discord.Attachment) -> bool:
-        # Downloads a txt personality file into the roles directory
-        try:
-            attachment.save(fp=os.path.join(self.roles_data_path, attachment.filename))
-        except Exception as e:
-            print(f"[ERROR] Failed to download personality file. {str(e)}")
-            return False
-        return True
+    async def download_personality_from_attachment(self, attachment: discord.Attachment) -> str:
+        # Downloads a txt personality file into the roles directory and returns its role text.
+        # Raises IngestionError if the file was rejected.
+        file_path = await self.ingestor.ingest(attachment, self.roles_data_path)
+        await asyncio.to_thread(self.roles.refresh)
+        return self.roles.get(os.path.basename(file_path))
 
 
 class DiscordBot:
     COMMAND_PERMISSION_ROLE = "bothandler"
     COMMAND_PREFIX = "$"
+    ENCODING_CACHE_PATH = "encoding_cache"
+    MAX_RESPONSE_MESSAGES = 4  # Longer responses are sent as a file attachment instead of as several messages
+    RESPONSE_FILE_NAME = "response.txt"
+    KNOWLEDGE_HEADER = "\n\nRelevant knowledge:\n"
+    # Seconds an idle conversation waits for more messages before it is answered. Messages that arrive while a
+    # response is being generated are answered together either way.
+    COALESCE_WINDOW = 0.0
+    MAX_COALESCED_MESSAGES = 8  # Most messages answered by a single response
     DEVELOPER_PORTAL_WEBSITE = "https://discord.com/developers/applications"
+    # Help texts of the exported metrics
+    METRIC_DESCRIPTIONS = {
+        "aurora_on_message_seconds": "Time spent handling a discord message event",
+        "aurora_messages_queued_total": "Messages queued for a response",
+        "aurora_messages_shed_total": "Messages ignored or dropped under load, by reason",
+        "aurora_queue_wait_seconds": "Time a message waited in the processing queue",
+        "aurora_coalesced_messages_total": "Messages answered together with another message",
+        "aurora_generate_seconds": "Time spent generating and sending a response",
+        "aurora_prompt_build_seconds": "Time spent building a prompt",
+        "aurora_prompts_total": "Prompts sent to the providers, by size class",
+        "aurora_llm_response_seconds": "Time until a provider answered a prompt",
+        "aurora_llm_failures_total": "Prompts that no provider answered",
+        "aurora_provider_attempt_seconds": "Time of a single provider attempt, by provider and outcome",
+        "aurora_provider_attempts_total": "Provider attempts, by provider and outcome",
+        "aurora_response_cache_requests_total": "Response cache lookups, by result",
+        "aurora_response_cache_entries": "Responses in the response cache",
+        "aurora_send_seconds": "Time spent sending a discord message",
+        "aurora_send_retries_total": "Sends retried after a rate limit or server error, by status",
+        "aurora_send_failures_total": "Messages that could not be sent",
+        "aurora_send_merged_total": "Command responses merged into another message",
+        "aurora_persistence_write_seconds": "Time spent writing server data, by kind",
+        "aurora_persistence_failures_total": "Failed writes of server data, by kind",
+        "aurora_queue_depth": "Messages waiting in the processing queue",
+        "aurora_active_conversations": "Conversations that are queued or being answered",
+        "aurora_cached_servers": "Server states held in memory",
+        "aurora_pending_writes": "Server data writes waiting to be flushed",
+        "aurora_outbound_queue_depth": "Messages waiting to be sent",
+    }
 
     def __init__(self, DISCORD_TOKEN: str, OWNER_ID: Optional[int],
-                 bot_directives_path: str = BotDataManager.DEFAULT_BOT_DIRECTIVES_PATH):
+                 bot_directives_path: str = BotDataManager.DEFAULT_BOT_DIRECTIVES_PATH,
+                 storage_backend: str = BotDataManager.STORAGE_JSON,
+                 max_concurrent_conversations: int = ConversationScheduler.DEFAULT_MAX_WORKERS,
+                 conversation_turn_quantum: int = ConversationScheduler.DEFAULT_TURN_QUANTUM,
+                 coalesce_window: float = COALESCE_WINDOW, max_coalesced_messages: int = MAX_COALESCED_MESSAGES,
+                 max_queue_depth: int = AdmissionController.DEFAULT_MAX_QUEUE_DEPTH,
+                 message_deadline: Optional[float] = AdmissionController.DEFAULT_DEADLINE,
+                 busy_reaction: Optional[str] = None,
+                 stream_responses: bool = False,
+                 min_response_time: Optional[Tuple[float, float]] = HumanizedLatencyPolicy.DEFAULT_MIN_RESPONSE_TIME,
+                 metrics_enabled: bool = True, metrics_sample_rate: float = Metrics.DEFAULT_SAMPLE_RATE,
+                 metrics_port: Optional[int] = None,
+                 response_cache_ttl: Optional[float] = None,
+                 summary_idle_delay: Optional[float] = ConversationSummarizer.DEFAULT_IDLE_DELAY,
+                 shard_count: Optional[int] = None, shard_ids: Optional[List[int]] = None,
+                 inference_addresses: Optional[List[Tuple[str, int]]] = None,
+                 process_start_time: Optional[float] = None, process_name: Optional[str] = None,
+                 provider_probe_interval: Optional[float] = ProviderProber.DEFAULT_INTERVAL):
+        # TPhase(str): seconds the phase of the startup took, reported once the bot is ready
+        self.startup_phases = {}
+        init_start_time = time.perf_counter()
+        if process_start_time is not None:
+            self.startup_phases["imports"] = init_start_time - process_start_time
+        self.process_start_time = process_start_time if process_start_time is not None else init_start_time
+
         # Sets up discord integration
         self.DISCORD_TOKEN = DISCORD_TOKEN
 
         intents = discord.Intents.default()
         intents.message_content = True
-        self.client: commands.Bot = commands.Bot(command_prefix=DiscordBot.COMMAND_PREFIX, intents=intents)
+        if shard_count is not None:
+            # Runs the given shards of the bot, the other shards may be run by other processes
+            self.client: commands.Bot = commands.AutoShardedBot(command_prefix=DiscordBot.COMMAND_PREFIX,
+                                                                intents=intents, shard_count=shard_count,
+                                                                shard_ids=shard_ids)
+        else:
+            self.client: commands.Bot = commands.Bot(command_prefix=DiscordBot.COMMAND_PREFIX, intents=intents)
         self.client.owner_id = OWNER_ID
         self.commands = {}
         self.help_command = None
 
-        # Instantiate Data Manager and LLM
-        self.Data = BotDataManager(bot_directives_path)
-        self.LLM = LLM()
-
-        # Messages Processing Queue
-        self.processing_queue = SimpleQueue()
-        self.in_queue_set = set()
+        # Timings and counters of the request pipeline, optionally served at http://127.0.0.1:metrics_port/metrics
+        self.metrics = Metrics(metrics_enabled, metrics_sample_rate)
+        self.metrics_port = metrics_port
+        self.metrics_server = None
 
-    def sanitize_username(self, username: str, allow_spaces=True) -> str:
+        # Instantiate Data Manager and LLM
+        self.Data = BotDataManager(bot_directives_path, storage_backend, metrics=self.metrics)
+        # Set when several gateway processes share the directives directory, so that each writes its own files
+        self.process_name = process_name
+        self.stream_responses = stream_responses
+        # Holds replies back so they are not sent faster than a person could answer. None disables it.
+        self.latency_policy = HumanizedLatencyPolicy(min_response_time)
+        # TServer_ID(str): last delayed delivery task of the conversation
+        self.delivery_tails = {}
+        encoding_cache_path = os.path.join(self.Data.directives_path, DiscordBot.ENCODING_CACHE_PATH)
+        routing_file_path = os.path.join(self.Data.directives_path, RoutingTable.TABLE_FILE_NAME)
+        if inference_addresses:
+            # Provider requests are handled by separate inference worker processes
+            self.LLM = RemoteLLM(InferenceClient.from_addresses(inference_addresses), metrics=self.metrics,
+                                 encoding_cache_path=encoding_cache_path, routing_file_path=routing_file_path)
+        else:
+            self.LLM = LLM(stats_file_path=self.get_process_file_path(LLM.PROVIDER_STATS_FILE_NAME),
+                           metrics=self.metrics, encoding_cache_path=encoding_cache_path,
+                           routing_file_path=routing_file_path)
+        # Probes idle providers in the background so that dead ones are found before a user's request hits them.
+        # Inference workers probe their own providers.
+        self.prober = None
+        if provider_probe_interval is not None and not inference_addresses:
+            self.prober = ProviderProber(self.LLM, interval=provider_probe_interval)
+        # Reuses responses to near-identical prompts. None disables the cache.
+        self.response_cache = None
+        if response_cache_ttl is not None:
+            self.response_cache = ResponseCache(ttl=response_cache_ttl, metrics=self.metrics)
+        # Passages of the documents in the knowledge directory are added to the role when they match the message
+        self.knowledge = KnowledgeIndex(self.Data.knowledge_data_path,
+                                        self.get_process_file_path(KnowledgeIndex.INDEX_FILE_NAME))
+        # Folds old turns into a running summary once a conversation goes idle. None drops them instead.
+        self.summarizer = None
+        if summary_idle_delay is not None:
+            self.summarizer = ConversationSummarizer(self.Data, self.LLM, idle_delay=summary_idle_delay)
+
+        # Messages Processing Queue. Conversations are serviced in parallel, messages within one in order.
+        # Messages that pile up in a channel of a conversation are answered together by a single response.
+        self.signal_handlers_installed = False
+        self.processing_queue = ConversationScheduler(self.process_queued_messages,
+                                                      max_workers=max_concurrent_conversations,
+                                                      turn_quantum=conversation_turn_quantum,
+                                                      max_batch=max_coalesced_messages,
+                                                      batch_window=coalesce_window,
+                                                      batch_key=lambda message: message.channel.id)
+        # TMessage_ID(int): time the message was queued
+        self.enqueue_times = {}
+        # Outgoing messages, sent in priority order within the discord rate limits
+        self.outbound = OutboundQueue(metrics=self.metrics)
+        # Rewrites mentions and names in the text going to and coming from the LLM
+        self.sanitizer = TextSanitizer()
+        # Sheds messages when the queue is full or a guild or user sends too fast, and drops messages that waited
+        # past the deadline. Shed messages optionally get the busy reaction.
+        self.admission = AdmissionController(max_queue_depth=max_queue_depth, deadline=message_deadline)
+        self.busy_reaction = busy_reaction
+
+        for name, description in DiscordBot.METRIC_DESCRIPTIONS.items():
+            self.metrics.describe(name, description)
+        self.metrics.gauge("aurora_queue_depth", self.processing_queue.queue_depth)
+        self.metrics.gauge("aurora_active_conversations", lambda: len(self.processing_queue.scheduled_keys))
+        self.metrics.gauge("aurora_cached_servers", lambda: len(self.Data.server_states))
+        self.metrics.gauge("aurora_pending_writes", self.Data.storage.pending_count)
+        self.metrics.gauge("aurora_outbound_queue_depth", self.outbound.queue_depth)
+        if self.response_cache is not None:
+            self.metrics.gauge("aurora_response_cache_entries", lambda: len(self.response_cache.entries))
+        self.init_done_time = time.perf_counter()
+        self.startup_phases["init"] = self.init_done_time - init_start_time
+
+    # Gets the path of a directives file that this process writes. Gateway processes prefix it with their name.
+    def get_process_file_path(self, file_name: str) -> str:
+        if self.process_name is not None:
+            file_name = f"{self.process_name}_{file_name}"
+        return os.path.join(self.Data.directives_path, file_name)
+
+    def sanitize_username(self, username: str) -> str:
         # Removes all characters except for alphanumeric and some symbols
-        username = re.sub(r'[^a-zA-Z0-9_]', '', username)
-        if not allow_spaces:
-            username = username.replace(' ', '')
-        return username
+        return TextSanitizer.sanitize_username(username)
 
     def sanitize_message_content(self, message: discord.Message) -> str:
-        content = message.content
-        # Formats the mentions in message to be readable with usernames instead of id
-        for mention in message.mentions:
-            if mention.id == self.client.user.id:
-                # Removes mention of the bot itself from the message
-                content = message.content.replace(f'<@{mention.id}>', '')
-            else:
-                display_name = self.sanitize_username(mention.display_name, allow_spaces=False)
-                content = message.content.replace(f'<@{mention.id}>', f'<@{display_name}>')
-
-        return content
+        # Formats the mentions in message to be readable with usernames instead of id.
+        # Mentions of the bot itself are removed from the message.
+        return self.sanitizer.sanitize_message_content(message.content, message.mentions,
+                                                       TextSanitizer.get_guild_id(message), self.client.user.id)
 
     def sanitize_bot_response(self, response: str) -> str:
-        # Removes the profile header string '[USERNAME]' from response
-        if response.find(':') != -1:
-            response = re.sub(r'^\[[^]]+]:\s*', '', response)
-        else:
-            response = re.sub(r'^\[[^]]+]\s*', '', response)
-
-        # Converts mention <@USERNAME> to USERNAME
-        response = re.sub(r'<@(.*?)>', lambda match: match.group(1), response)
-        return response
+        # Removes the profile header string '[USERNAME]' from response and converts mention <@USERNAME> to USERNAME
+        return TextSanitizer.sanitize_bot_response(response)
 
     def execute_actions_in_bot_response(self, response):
         # Inserts pictures, adds reactions, etc based on searchable tokens. ex: '@{PICTURE OF DEER}'
         pass
 
-    def add_role_contexts(self, server_folder: str, message: discord.Message) -> str:
-        role = self.Data.roles[server_folder]
-        # Adds context to system role from embedding extraction (pdf search)
-        return role
+    # Gets the context that is added to the system role for these messages
+    def get_role_context(self, messages: List[discord.Message]) -> str:
+        # Adds the knowledge base passages that are most relevant to the messages
+        self.knowledge.schedule_refresh()
+        passages = self.knowledge.search(" ".join(message.content for message in messages))
+        if passages:
+            return DiscordBot.KNOWLEDGE_HEADER + "\n---\n".join(passages)
+        return ""
+
+    # Answers one or more messages of the same conversation with a single response
+    async def generate_conversation_response(self, messages: List[discord.Message]):
+        # The reply goes to the most recent message
+        message = messages[-1]
 
-    async def generate_conversation_response(self, message: discord.Message):
         # Get the unique server identifier for the message source
         server_folder = self.Data.message_source_to_server_folder(message)
-        self.Data.init_source_server_folder(server_folder)
+        await self.Data.init_source_server_folder(server_folder)
 
-        # Processes the content of the message for the LLM
-        user_message = self.sanitize_message_content(message)
+        # Processes the content of the messages for the LLM. Each line is prefixed with the author's username.
+        prompt_start_time = time.perf_counter()
+        guild_id = TextSanitizer.get_guild_id(message)
+        user_message = "\n".join(f"[{self.sanitizer.get_display_name(guild_id, queued_message.author)}]: "
+                                 f"{self.sanitize_message_content(queued_message)}" for queued_message in messages)
         print(f"\n[SERVICING {server_folder}]")  # Prints Server ID
         print("INPUT: ", user_message)  # Prints Prompt
-        user_message = {"role": "user", "content": f"[{self.sanitize_username(message.author.display_name)}]: {user_message}"}
-
-        # Process and add context to the system role
-        context_added_role = self.add_role_contexts(server_folder, message)
-        system_role = {"role": "system", "content": context_added_role}
-
-        # Prompt Message
-        prompt_messages = [system_role] + self.Data.messages[server_folder] + [user_message]
-
-
-        # Ensures that the token limit isn't reached
-        while self.LLM.compute_messages_token_count(prompt_messages) > LLM.TOKEN_COUNT_THRESHOLD:
-            prompt_messages.pop(1)
-
-        # Generate Conversation Response from the LLM
-        response = await self.LLM.LLM_get_response(prompt_messages)
+        user_message = await self.LLM.create_message("user", user_message)
+
+        # Process and add context to the system role. The role's token count is cached, only the context is counted.
+        role = self.Data.get_role(server_folder)
+        role_context = self.get_role_context(messages)
+        system_role = {"role": "system", "content": role + role_context}
+        role_token_count = await self.LLM.count_role_tokens_async(role)
+        if role_context:
+            role_token_count += await self.LLM.count_tokens_async(role_context)
+        system_messages = [system_role]
+        summary_message = self.summarizer.get_summary_message(server_folder) if self.summarizer else None
+        if summary_message is not None:
+            # The summary of the older turns sits right after the system role
+            system_messages.append(summary_message)
+            role_token_count += await self.summarizer.get_summary_token_count(server_folder)
+
+        # Ensures that the token limit isn't reached. Token counts are cached on each message of the history.
+        # The budget is the limit of the provider that accepts the longest prompts, smaller providers still get
+        # the prompts that fit them.
+        history = self.Data.get_messages(server_folder)
+        await self.LLM.ensure_token_counts(history)
+        token_budget = self.LLM.get_token_budget()
+        history, prompt_tokens = LLM.trim_messages_to_budget(history + [user_message], role_token_count, token_budget)
+        self.metrics.increment("aurora_prompts_total", size=self.LLM.routing.size_class(prompt_tokens))
+        self.metrics.observe("aurora_prompt_build_seconds", time.perf_counter() - prompt_start_time)
+
+        # Looks for a cached response to the same prompt first
+        response = None
+        cache_key = None
+        if self.response_cache is not None and self.Data.get_metadata(server_folder).get("response_cache", True):
+            cache_key = self.response_cache.create_key(
+                "\n".join(system_message["content"] for system_message in system_messages), history)
+            response = self.response_cache.get(cache_key)
+
+        # Generate Conversation Response from the LLM. When streaming, the reply is posted and edited as it arrives.
+        progressive_message = None
+        if response is not None:
+            print("\tCACHE HIT")
+        elif self.stream_responses:
+            progressive_message = ProgressiveMessage(
+                lambda text: self.send_message(message_info=message, response=text, ref=message,
+                                               priority=OutboundQueue.PRIORITY_REPLY),
+                lambda text: self.send_to_channel(message, text, priority=OutboundQueue.PRIORITY_REPLY),
+                lambda text: self.send_to_channel(message, None, file=self.create_response_file(text),
+                                                  priority=OutboundQueue.PRIORITY_REPLY),
+                DiscordBot.MAX_RESPONSE_MESSAGES)
+            response = await self.LLM.LLM_stream_response(
+                system_messages + LLM.strip_token_counts(history),
+                lambda text: progressive_message.update(self.sanitize_bot_response(text)), prompt_tokens)
+        else:
+            response = await self.LLM.LLM_get_response(system_messages + LLM.strip_token_counts(history), prompt_tokens)
         if response is None:
             print("[ERROR] Bot Failed to generate response!")
+            if progressive_message is not None:
+                await progressive_message.abort()
             return
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
         print("OUTPUT: ", response)  # Print Response
 
         # If there are actions specified, execute them.
         self.execute_actions_in_bot_response(response)
 
-        # Adds bot response to messages. Ensures that the token limit isn't reached
-        prompt_messages.append({"role": "assistant", "content": self.sanitize_bot_response(response)})
-        while self.LLM.compute_messages_token_count(prompt_messages) > LLM.TOKEN_COUNT_THRESHOLD:
-            prompt_messages.pop(1)
+        # Adds bot response to messages. Ensures that the token limit isn't reached.
+        # Starts from the stored history, which may have been compacted or cleared while the response was generated.
+        sanitized_response = self.sanitize_bot_response(response)
+        assistant_message = await self.LLM.create_message("assistant", sanitized_response)
+        history, _ = LLM.trim_messages_to_budget(
+            self.Data.get_messages(server_folder) + [user_message, assistant_message], role_token_count, token_budget)
 
         # Updates the message history
-        self.Data.messages[server_folder] = prompt_messages[1:]
-        self.Data.update_messages_file(server_folder)
+        self.Data.set_messages(server_folder, history)
+        self.Data.update_messages_file(server_folder, appended=[user_message, assistant_message])
+        if self.summarizer is not None:
+            self.summarizer.schedule(server_folder)
 
         # Sends the response to discord
-        await self.send_message(message_info=message, response=self.sanitize_bot_response(response), ref=message)
+        if progressive_message is not None:
+            await progressive_message.finish(sanitized_response)
+        else:
+            await self.schedule_delivery(server_folder, message, lambda: self.send_message(
+                message_info=message, response=sanitized_response, ref=message, priority=OutboundQueue.PRIORITY_REPLY))
+
+    # Delivers a reply once the humanized latency has passed, without holding up the worker that generated it.
+    # Deliveries of a conversation stay in order.
+    async def schedule_delivery(self, server_folder: str, message: discord.Message,
+                                deliver: Callable[[], Awaitable]):
+        delay = self.latency_policy.remaining_delay(message.created_at)
+        previous = self.delivery_tails.get(server_folder)
+        if delay <= 0 and (previous is None or previous.done()):
+            await deliver()
+            return
 
-    # Sends message to the user to whatever channel they are in. Optionally, perform a reply.
-    async def send_message(self, message_info: discord.Message, response: str, ref: Optional[discord.Message] = None):
+        task = asyncio.create_task(self.delayed_delivery(previous, delay, message, deliver))
+        self.delivery_tails[server_folder] = task
+
+        def remove_tail(finished_task: asyncio.Task):
+            if self.delivery_tails.get(server_folder) is finished_task:
+                del self.delivery_tails[server_folder]
+        task.add_done_callback(remove_tail)
+
+    async def delayed_delivery(self, previous: Optional[asyncio.Task], delay: float, message: discord.Message,
+                               deliver: Callable[[], Awaitable]):
         try:
-            if isinstance(message_info.channel, discord.DMChannel):
-                # Send to DMs
-                await message_info.author.send(response, reference=ref)
-            else:
-                # Send to public channel
-                await message_info.channel.send(response, reference=ref)
+            # Keeps typing while the reply is held back
+            async with message.channel.typing():
+                if previous is not None:
+                    await asyncio.wait([previous])
+                await asyncio.sleep(delay)
+            await deliver()
         except Exception as e:
-            print(f"[ERROR] Failed to send message. {str(e)}")
+            print(f"[ERROR] Failed to deliver message. {str(e)}")
+
+    # Sends message to the user to whatever channel they are in. Optionally, perform a reply.
+    # Responses over discord's length limit are split into several messages, sent in order. Only the first one is a
+    # reply. Returns the first message.
+    async def send_message(self, message_info: discord.Message, response: str,
+                           ref: Optional[discord.Message] = None,
+                           priority: int = OutboundQueue.PRIORITY_COMMAND) -> Optional[discord.Message]:
+        chunks = split_response(response)
+        if len(chunks) > DiscordBot.MAX_RESPONSE_MESSAGES:
+            # Too long to read as messages, the first part is shown and the whole response attached
+            return await self.send_to_channel(message_info, chunks[0], ref, file=self.create_response_file(response),
+                                              priority=priority)
+
+        first_message = None
+        for index, chunk in enumerate(chunks):
+            sent_message = await self.send_to_channel(message_info, chunk, ref if index == 0 else None,
+                                                      priority=priority)
+            if sent_message is None:
+                break
+            first_message = first_message or sent_message
+        return first_message
+
+    @staticmethod
+    def create_response_file(response: str) -> discord.File:
+        return discord.File(io.BytesIO(response.encode("utf-8")), filename=DiscordBot.RESPONSE_FILE_NAME)
+
+    # Queues the send behind the other messages to the same channel. Rate limits and retries are handled by the queue.
+    async def send_to_channel(self, message_info: discord.Message, content: Optional[str],
+                              ref: Optional[discord.Message] = None, file: Optional[discord.File] = None,
+                              priority: int = OutboundQueue.PRIORITY_COMMAND) -> Optional[discord.Message]:
+        if isinstance(message_info.channel, discord.DMChannel):
+            # Send to DMs
+            route, send = ("dm", message_info.author.id), message_info.author.send
+        else:
+            # Send to public channel
+            route, send = ("channel", message_info.channel.id), message_info.channel.send
+        return await self.outbound.send(route, send, content, priority=priority, reference=ref, file=file)
 
     # Function that registers commands to the bot
     def add_command(self, command: callable, perm_level: int, description: Optional[str] = None):
@@ -322,30 +602,91 @@ class DiscordBot:
 
         return False
 
-    # Processes the message (generates a response)
-    async def process_message(self, message: discord.Message):
-        # Generates response
-        inference_task = asyncio.create_task(self.generate_conversation_response(message))
-
-        # Gives random delay to then start typing indicator
-        await asyncio.sleep(random.uniform(2, 5))
+    # Processes the messages (generates a response)
+    async def process_messages(self, messages: List[discord.Message]):
+        # Shows the typing indicator for as long as inference runs
+        async with messages[-1].channel.typing():
+            with self.metrics.timer("aurora_generate_seconds"):
+                await self.generate_conversation_response(messages)
+
+    # Takes a batch of messages of one conversation off the processing queue. Called by the scheduler's workers.
+    async def process_queued_messages(self, messages: List[discord.Message]):
+        fresh_messages = []
+        for message in messages:
+            enqueue_time = self.enqueue_times.pop(message.id, None)
+            if enqueue_time is not None:
+                self.metrics.observe("aurora_queue_wait_seconds", time.perf_counter() - enqueue_time)
+                # Stale messages are not worth the provider time anymore
+                if self.admission.is_expired(enqueue_time):
+                    await self.shed_message(message, "deadline")
+                    continue
+            fresh_messages.append(message)
+        if not fresh_messages:
+            return
+        messages = fresh_messages
+        if len(messages) > 1:
+            self.metrics.increment("aurora_coalesced_messages_total", len(messages) - 1)
+        await self.process_messages(messages)
 
-        # Starts typing indicator if the task is not done.
-        async with message.channel.typing():
-            await inference_task
+    # Loads the tokenizer and the providers in the background once connected, then reports the startup breakdown
+    async def prewarm(self):
+        try:
+            await self.LLM.prewarm()
+        except Exception as e:
+            print(f"[ERROR] Failed to prewarm. {str(e)}")
+        self.startup_phases.update(self.LLM.load_times)
+        print("[SYSTEM] Startup: " + ", ".join(f"{phase} {seconds:.2f}s"
+                                               for phase, seconds in self.startup_phases.items()))
+
+    # Rejects a message the bot has no capacity for
+    async def shed_message(self, message: discord.Message, reason: str):
+        self.metrics.increment("aurora_messages_shed_total", reason=reason)
+        if self.busy_reaction is None:
+            return
+        try:
+            await message.add_reaction(self.busy_reaction)
+        except Exception as e:
+            print(f"[ERROR] Failed to add reaction. {str(e)}")
 
-    # Loops indefinitely. Called when the bot is in an on_ready state
+    # Starts the message processing workers. Called when the bot is in an on_ready state
     async def loop(self):
-        while True:
-            # Repeatedly processes messages from users one at a time.
-            if not self.processing_queue.empty():
-                message = self.processing_queue.get()
-                self.in_queue_set.remove(message.author.id)
-                await self.process_message(message)
-            else:
-                await asyncio.sleep(0.2)
-
-    def run(self):
+        self.processing_queue.start()
+        self.knowledge.schedule_refresh()
+        self.Data.roles.start_watching()
+        self.Data.server_states.start_sweeping()
+        if self.prober is not None:
+            self.prober.start()
+
+    # Serves the metrics endpoint if a port was configured
+    async def start_metrics_server(self):
+        if self.metrics_port is None or self.metrics_server is not None:
+            return
+        try:
+            self.metrics_server = await self.metrics.start_http_server("127.0.0.1", self.metrics_port)
+            print(f'[SYSTEM] Metrics available at http://127.0.0.1:{self.metrics_port}/metrics')
+        except OSError as e:
+            print(f"[ERROR] Failed to start metrics server. {str(e)}")
+
+    # Closes the connection gracefully on SIGTERM so that pending data gets flushed
+    def install_signal_handlers(self):
+        if self.signal_handlers_installed:
+            return
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.client.close()))
+            self.signal_handlers_installed = True
+        except (NotImplementedError, RuntimeError):
+            # Signal handlers are not supported by the event loop on this platform
+            pass
+
+    # Persists everything that is still pending. Called after the client stops.
+    def shutdown(self):
+        print("[SYSTEM] Flushing pending data...")
+        self.Data.close()
+        self.LLM.save_provider_stats(force=True)
+
+    # Registers the client events and bot commands. Called by run().
+    def setup(self):
 
         # ========================================= #
         #               Client Events
@@ -359,12 +700,36 @@ class DiscordBot:
 
             # Initializations
             await self.client.change_presence(status=discord.Status.online)
+            self.install_signal_handlers()
+            await self.start_metrics_server()
 
-            # Runs processing loop
+            # Starts processing workers (on_ready may fire again after a reconnect)
             await self.loop()
 
+            if "connect" not in self.startup_phases:
+                self.startup_phases["connect"] = time.perf_counter() - self.init_done_time
+                print(f'[SYSTEM] Ready in {time.perf_counter() - self.process_start_time:.2f}s')
+                asyncio.create_task(self.prewarm())
+
+        # Display names are cached per guild, changes are picked up when the member is next seen as well
+        @self.client.event
+        async def on_member_update(before: discord.Member, after: discord.Member):
+            self.sanitizer.invalidate_member(after.guild.id, after.id)
+
+        @self.client.event
+        async def on_member_remove(member: discord.Member):
+            self.sanitizer.invalidate_member(member.guild.id, member.id)
+
+        @self.client.event
+        async def on_guild_remove(guild: discord.Guild):
+            self.sanitizer.invalidate_guild(guild.id)
+
         @self.client.event
         async def on_message(message: discord.Message):
+            with self.metrics.timer("aurora_on_message_seconds"):
+                await handle_message(message)
+
+        async def handle_message(message: discord.Message):
             # Ensures that event only triggers on messages not generated by itself
             if message.author == self.client.user:
                 return
@@ -384,11 +749,17 @@ class DiscordBot:
                 await on_command(message)
                 return
 
-            # Adds message to processing queue only if user does not have a request in queue
-            if message.author.id in self.in_queue_set:
+            # Sheds the message if the queue is full or the guild or user is sending too fast
+            reason = self.admission.admit(message.guild.id if message.guild else None, message.author.id,
+                                          self.processing_queue.queue_depth())
+            if reason is not None:
+                await self.shed_message(message, reason)
                 return
-            self.in_queue_set.add(message.author.id)
-            self.processing_queue.put(message)
+
+            # Adds message to processing queue. Messages that queue up in a conversation are answered together.
+            self.enqueue_times[message.id] = time.perf_counter()
+            self.processing_queue.submit(self.Data.message_source_to_server_folder(message), message)
+            self.metrics.increment("aurora_messages_queued_total")
 
         # ========================================= #
         #               Bot Commands
@@ -423,7 +794,9 @@ class DiscordBot:
                 return
 
             # Result if the personality sucessfully switched
-            result = self.Data.switch_selected_role(self.Data.message_source_to_server_folder(message), args[1])
+            server_folder = self.Data.message_source_to_server_folder(message)
+            await self.Data.init_source_server_folder(server_folder)
+            result = self.Data.switch_selected_role(server_folder, args[1])
             if result:
                 await self.send_message(message, f"Personality switched to {args[1]}.", message)
             else:
@@ -449,20 +822,43 @@ class DiscordBot:
                     return
 
                 # Download personality file into the directory
-                result = self.Data.download_personality_from_attachment(attachment)
-                if result:
-                    await self.send_message(message, f"Personality {attachment.filename} added!", message)
-                else:
+                try:
+                    role = await self.Data.download_personality_from_attachment(attachment)
+                except IngestionError as e:
+                    await self.send_message(message, f"Failed to add {attachment.filename}. {str(e)}", message)
+                    return
+                except Exception as e:
+                    print(f"[ERROR] Failed to download personality file. {str(e)}")
                     await self.send_message(message, f"Failed to download {attachment.filename}.", message)
+                    return
+                # Tokenizes the role now so that its first use does not have to
+                role_token_count = await self.LLM.count_role_tokens_async(role)
+                await self.send_message(message, f"Personality {attachment.filename} added! "
+                                                 f"({role_token_count} tokens)", message)
             else:
                 await self.send_message(message, f"Invalid attachment type! Please attach a .txt file to the message.",
                                         message)
 
+        # Toggle Response Cache Command
+        async def toggle_response_cache(message: discord.Message):
+            if self.response_cache is None:
+                await self.send_message(message, "The response cache is disabled for this bot.", message)
+                return
+            server_folder = self.Data.message_source_to_server_folder(message)
+            metadata = (await self.Data.load_server_state(server_folder)).metadata
+            metadata["response_cache"] = not metadata.get("response_cache", True)
+            self.Data.update_metadata_file(server_folder)
+            state = "enabled" if metadata["response_cache"] else "disabled"
+            await self.send_message(message, f"Response cache {state}.", message)
+
         # Clear History Command
         async def clear_history(message: discord.Message):
             server_folder = self.Data.message_source_to_server_folder(message)
-            self.Data.messages[server_folder] = []
+            await self.Data.init_source_server_folder(server_folder)
+            self.Data.set_messages(server_folder, [])
             self.Data.update_messages_file(server_folder)
+            if self.summarizer is not None:
+                self.summarizer.clear(server_folder)
             await self.send_message(message, f"History Cleared!", message)
 
         async def nickname(message: discord.Message):
@@ -493,8 +889,8 @@ class DiscordBot:
             if len(args) == 1:
                 # If no role is specified, just display for the selected role
                 server_folder = self.Data.message_source_to_server_folder(message)
-                if server_folder in self.Data.roles:
-                    await self.send_message(message, f"```\n{self.Data.roles[server_folder]}```", message)
+                if await self.Data.load_server_state(server_folder, create=False) is not None:
+                    await self.send_message(message, f"```\n{self.Data.get_role(server_folder)}```", message)
                 else:
                     await self.send_message(message, f"Role does not exist.", message)
                 return
@@ -511,17 +907,28 @@ class DiscordBot:
         # Bot Info Command
         async def bot_info(message: discord.Message):
             server_folder = self.Data.message_source_to_server_folder(message)
-            if server_folder not in self.Data.metadata:
+            state = await self.Data.load_server_state(server_folder, create=False)
+            if state is None:
                 await self.send_message(message, "No data found for this bot.", message)
                 return
+            metadata = state.metadata
 
             # Prints out information
             info_message = "```\nBot Information:\n"
             info_message += "\nserver_id: " + server_folder
-            for key, value in self.Data.metadata[server_folder].items():
+            for key, value in metadata.items():
+                if key == ConversationSummarizer.SUMMARY_KEY:
+                    value = f"{len(value)} characters"
                 info_message += "\n" + key + ": " + str(value)
             await self.send_message(message, info_message + "```", message)
 
+        # Pipeline Statistics Command
+        async def stats(message: discord.Message):
+            if not self.metrics.enabled:
+                await self.send_message(message, "Metrics are disabled.", message)
+                return
+            await self.send_message(message, f"```\n{self.metrics.render_summary()[:1900]}```", message)
+
         # Help Command
         async def help_commands(message: discord.Message):
             help_message = "```\nList of Commands:\n"
@@ -542,8 +949,16 @@ class DiscordBot:
         self.add_command(clear_history, 1, " - Clears local chat history")
         self.add_command(bot_info, 0, " - Gets the current server's bot information")
         self.add_command(nickname, 1, " [nickname] - Sets the nickname of the bot")
+        self.add_command(toggle_response_cache, 1, " - Turns reusing cached responses on or off")
+        self.add_command(stats, 2, " - Gets request pipeline statistics")
         self.add_command(help_commands, 0, " - Gets list of commands and information")
         self.help_command = help_commands
 
+    def run(self):
+        self.setup()
+
         # Runs loop for bot
-        self.client.run(self.DISCORD_TOKEN)
+        try:
+            self.client.run(self.DISCORD_TOKEN)
+        finally:
+            self.shutdown()
@@ -0,0 +1,54 @@
+import re
+from typing import List
+
+MESSAGE_LENGTH_LIMIT = 1980  # Longest text sent in one discord message, leaves room below the 2000 character limit
+
+# The language after an opening fence is short, anything longer is not repeated when the block is reopened
+CODE_FENCE_PATTERN = re.compile(r"^```([\w+#.-]{0,20})", re.MULTILINE)
+MIN_CHUNK_BUDGET = 100  # Fewest characters of text every chunk carries, so that splitting always makes progress
+# Break points, best first: blank line, line break, end of sentence, whitespace
+BREAK_PATTERNS = [re.compile(r"\n\s*\n"), re.compile(r"\n"), re.compile(r"[.!?](?=\s)"), re.compile(r"\s")]
+
+
+def split_response(text: str, limit: int = MESSAGE_LENGTH_LIMIT) -> List[str]:
+    # Splits text into chunks of at most limit characters at paragraph, line or sentence boundaries.
+    # A code block that is cut in two is closed at the end of the chunk and reopened in the next one.
+    chunks = []
+    open_fence = None
+    while text:
+        prefix = f"```{open_fence}\n" if open_fence is not None else ""
+        # Reserves room for reopening and closing a code fence
+        budget = limit - len(prefix) - 4
+        if budget < MIN_CHUNK_BUDGET:
+            # The limit is too small to reopen the block, continues without the fence
+            prefix, open_fence = "", None
+            budget = max(limit - 4, 1)
+        if len(prefix) + len(text) <= limit and _open_fence_after(text, open_fence) is None:
+            chunks.append(prefix + text)
+            break
+
+        cut = _find_break(text, budget) if len(text) > budget else len(text)
+        chunk, text = text[:cut].rstrip(), text[cut:].lstrip("\n ")
+        open_fence = _open_fence_after(chunk, open_fence)
+        if open_fence is not None:
+            chunk += "\n```"
+        if chunk.strip():
+            chunks.append(prefix + chunk)
+    return chunks
+
+
+def _find_break(text: str, budget: int) -> int:
+    window = text[:budget]
+    for pattern in BREAK_PATTERNS:
+        matches = [match.end() for match in pattern.finditer(window)]
+        # Ignores break points that would leave a tiny chunk
+        if matches and matches[-1] > budget // 3:
+            return matches[-1]
+    return budget
+
+
+def _open_fence_after(text: str, open_fence):
+    # Gets the language of the code block that is still open at the end of text, or None
+    for match in CODE_FENCE_PATTERN.finditer(text):
+        open_fence = match.group(1) if open_fence is None else None
+    return open_fence
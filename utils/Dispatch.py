@@ -0,0 +1,85 @@
+import time
+from typing import Dict
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    DEFAULT_FAILURE_THRESHOLD = 3  # Consecutive failures before the breaker trips
+    DEFAULT_RECOVERY_TIME = 60.0  # Seconds an open breaker waits before a recovery probe
+    MAX_RECOVERY_TIME = 1800.0  # Upper bound for the backed off recovery time
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 recovery_time: float = DEFAULT_RECOVERY_TIME):
+        self.failure_threshold = failure_threshold
+        self.base_recovery_time = recovery_time
+        self.recovery_time = recovery_time
+        self.state = CircuitBreaker.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        # Determines if a request may be sent through the breaker
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+        if self.state == CircuitBreaker.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_time:
+                return False
+            self.state = CircuitBreaker.HALF_OPEN
+            self.probe_in_flight = False
+
+        # Half open: only a single recovery probe may be in flight
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    # Whether the breaker is open and its recovery time has not passed yet. Once it has, the next request is the probe.
+    def is_cooling_down(self) -> bool:
+        return self.state == CircuitBreaker.OPEN and time.monotonic() - self.opened_at < self.recovery_time
+
+    def record_success(self):
+        self.state = CircuitBreaker.CLOSED
+        self.consecutive_failures = 0
+        self.recovery_time = self.base_recovery_time
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == CircuitBreaker.HALF_OPEN:
+            # Failed recovery probe, waits longer before trying again
+            self.recovery_time = min(self.recovery_time * 2, CircuitBreaker.MAX_RECOVERY_TIME)
+            self._trip()
+        elif self.consecutive_failures >= self.failure_threshold:
+            self._trip()
+
+    def release(self):
+        # Called when a request was cancelled before it could succeed or fail
+        self.probe_in_flight = False
+
+    def _trip(self):
+        self.state = CircuitBreaker.OPEN
+        self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+
+
+class CircuitBreakerRegistry:
+    def __init__(self, failure_threshold: int = CircuitBreaker.DEFAULT_FAILURE_THRESHOLD,
+                 recovery_time: float = CircuitBreaker.DEFAULT_RECOVERY_TIME):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        # TProvider_Name(str): CircuitBreaker
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(self.failure_threshold, self.recovery_time)
+        return self.breakers[name]
+
+    # Whether requests to the provider are still being held back. A breaker that is due for its recovery probe does not
+    # count as open, so that regular requests can send the probe.
+    def is_open(self, name: str) -> bool:
+        return name in self.breakers and self.breakers[name].is_cooling_down()
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from itertools import count
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.LLM import LLM
+from utils.Metrics import Metrics
+from utils.Prober import ProviderProber
+from utils.Routing import RoutingTable
+
+
+# ========================================= #
+#          Inference Worker Process
+# ========================================= #
+
+# Requests and responses are newline delimited json frames on a local tcp connection:
+#   {"id": int, "type": "generate" | "stream", "messages": [...],
+#    "prompt_tokens": int | null}                                  gateway -> worker
+#   {"id": int, "type": "partial", "text": str}                    worker -> gateway, streamed text so far
+#   {"id": int, "type": "result", "text": str | null}              worker -> gateway, ends the request
+
+class InferenceWorker:
+    def __init__(self, llm: LLM):
+        self.llm = llm
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Serves the requests of one gateway process. Requests are handled concurrently.
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.handle_request(json.loads(line), writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def handle_request(self, request: dict, writer: asyncio.StreamWriter, write_lock: asyncio.Lock):
+        async def send_frame(frame: dict):
+            async with write_lock:
+                writer.write(json.dumps(frame).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        try:
+            if request["type"] == "stream":
+                response = await self.llm.LLM_stream_response(
+                    request["messages"],
+                    lambda text: send_frame({"id": request["id"], "type": "partial", "text": text}),
+                    request.get("prompt_tokens"))
+            else:
+                response = await self.llm.LLM_get_response(request["messages"], request.get("prompt_tokens"))
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            print(f"[ERROR] Inference request failed. {str(e)}")
+            response = None
+        await send_frame({"id": request["id"], "type": "result", "text": response})
+
+
+def run_inference_worker(index: int, address_queue, stats_file_path: Optional[str], hedge_width: int,
+                         provider_timeout: float, routing_file_path: Optional[str] = None):
+    # Entry point of an inference worker process. Reports its address on the queue once it is listening.
+    async def serve():
+        worker = InferenceWorker(LLM(hedge_width, provider_timeout, stats_file_path=stats_file_path,
+                                     routing_file_path=routing_file_path))
+        await worker.llm.prewarm()
+        prober = ProviderProber(worker.llm)
+        prober.start()
+        server = await asyncio.start_server(worker.handle_connection, "127.0.0.1", 0)
+        address = server.sockets[0].getsockname()[:2]
+        print(f"[SYSTEM] Inference worker {index} listening on {address[0]}:{address[1]}")
+        address_queue.put((index, address))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.llm.save_provider_stats(force=True)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_inference_workers(worker_count: int, directives_path: str, hedge_width: int = LLM.HEDGE_WIDTH,
+                            provider_timeout: float = LLM.PROVIDER_TIMEOUT,
+                            startup_timeout: float = 60.0) -> Tuple[list, List[Tuple[str, int]]]:
+    # Spawns the worker processes and waits until all of them are listening. Each keeps its own provider statistics.
+    context = multiprocessing.get_context("spawn")
+    address_queue = context.Queue()
+    processes = []
+    routing_file_path = os.path.join(directives_path, RoutingTable.TABLE_FILE_NAME)
+    for index in range(worker_count):
+        stats_file_path = os.path.join(directives_path, f"worker_{index}_{LLM.PROVIDER_STATS_FILE_NAME}")
+        process = context.Process(target=run_inference_worker, name=f"inference-worker-{index}", daemon=True,
+                                  args=(index, address_queue, stats_file_path, hedge_width, provider_timeout,
+                                        routing_file_path))
+        process.start()
+        processes.append(process)
+
+    addresses: List[Optional[Tuple[str, int]]] = [None] * worker_count
+    for _ in range(worker_count):
+        index, address = address_queue.get(timeout=startup_timeout)
+        addresses[index] = tuple(address)
+    return processes, addresses
+
+
+# ========================================= #
+#              Gateway Side Client
+# ========================================= #
+
+class InferenceConnection:
+    RECONNECT_DELAY = 5.0  # Seconds a worker that could not be reached is skipped
+
+    def __init__(self, open_connection: Callable[[], Awaitable[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]]):
+        # Opens the stream pair to the worker. Tests can pass an in-process stand-in.
+        self.open_connection = open_connection
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+        self.connect_lock: Optional[asyncio.Lock] = None
+        self.request_ids = count()
+        # TRequest_ID(int): queue of frames received for the request
+        self.pending: Dict[int, asyncio.Queue] = {}
+        self.unavailable_until = 0.0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.unavailable_until
+
+    async def request(self, request_type: str, messages: List[dict],
+                      on_update: Optional[Callable[[str], Awaitable[None]]] = None,
+                      prompt_tokens: Optional[int] = None) -> Optional[str]:
+        # Raises ConnectionError if the worker could not be reached or went away before responding
+        try:
+            writer = await self.connect()
+        except (ConnectionError, OSError):
+            self.unavailable_until = time.monotonic() + InferenceConnection.RECONNECT_DELAY
+            raise
+
+        request_id = next(self.request_ids)
+        frames = asyncio.Queue()
+        self.pending[request_id] = frames
+        try:
+            writer.write(json.dumps({"id": request_id, "type": request_type, "messages": messages,
+                                     "prompt_tokens": prompt_tokens}).encode("utf-8") + b"\n")
+            await writer.drain()
+            while True:
+                frame = await frames.get()
+                if frame["type"] == "result":
+                    return frame["text"]
+                if frame["type"] == "lost":
+                    raise ConnectionError("Connection to the inference worker was lost")
+                # Skips partial text that is already outdated
+                if not frames.empty():
+                    continue
+                if on_update is not None:
+                    await on_update(frame["text"])
+        finally:
+            del self.pending[request_id]
+
+    async def connect(self) -> asyncio.StreamWriter:
+        if self.connect_lock is None:
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if self.writer is None:
+                reader, self.writer = await self.open_connection()
+                self.reader_task = asyncio.create_task(self._read_frames(reader, self.writer))
+            return self.writer
+
+    async def _read_frames(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Routes the frames of the worker to the waiting requests
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = json.loads(line)
+                frames = self.pending.get(frame["id"])
+                if frames is not None:
+                    frames.put_nowait(frame)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            # Fails whatever was still waiting, the next request reconnects
+            if self.writer is writer:
+                self.writer = None
+            writer.close()
+            for request_id, frames in self.pending.items():
+                frames.put_nowait({"id": request_id, "type": "lost"})
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+
+
+class InferenceClient:
+    def __init__(self, connections: List[InferenceConnection]):
+        self.connections = connections
+
+    @staticmethod
+    def from_addresses(addresses: List[Tuple[str, int]]) -> "InferenceClient":
+        return InferenceClient([InferenceConnection(lambda host=host, port=port: asyncio.open_connection(host, port))
+                                for host, port in addresses])
+
+    async def request(self, request_type: str, messages: List[dict],
+                      on_update: Optional[Callable[[str], Awaitable[None]]] = None,
+                      prompt_tokens: Optional[int] = None) -> Optional[str]:
+        # Sends the request to the reachable worker with the fewest requests in flight.
+        # If that worker is down, the next one is tried.
+        candidates = sorted(self.connections, key=lambda candidate: (not candidate.available(), len(candidate.pending)))
+        for connection in candidates:
+            try:
+                return await connection.request(request_type, messages, on_update, prompt_tokens)
+            except (ConnectionError, OSError) as e:
+                print(f"[ERROR] Inference worker unavailable. {str(e)}")
+        return None
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+
+
+class RemoteLLM(LLM):
+    # Counts tokens locally and leaves the provider requests to the inference worker processes.
+    # Messages of one conversation are still answered in order, the scheduler waits for each response.
+
+    def __init__(self, client: InferenceClient, metrics: Optional[Metrics] = None,
+                 encoding_cache_path: Optional[str] = None, routing_file_path: Optional[str] = None):
+        # The routing table is only read here for the token budget, the workers route the requests
+        super().__init__(metrics=metrics, encoding_cache_path=encoding_cache_path, routing_file_path=routing_file_path)
+        self.client = client
+
+    # The providers are only needed by the workers
+    async def prewarm(self, load_providers: bool = False):
+        await super().prewarm(load_providers)
+
+    async def LLM_get_response(self, all_messages_raw: List[dict],
+                               prompt_tokens: Optional[int] = None) -> Optional[str]:
+        with self.metrics.timer("aurora_llm_response_seconds"):
+            response = await self.client.request("generate", all_messages_raw, prompt_tokens=prompt_tokens)
+        if response is None:
+            self.metrics.increment("aurora_llm_failures_total")
+        return response
+
+    async def LLM_stream_response(self, all_messages_raw: List[dict], on_update: Callable[[str], Awaitable[None]],
+                                  prompt_tokens: Optional[int] = None) -> Optional[str]:
+        with self.metrics.timer("aurora_llm_response_seconds"):
+            response = await self.client.request("stream", all_messages_raw, on_update, prompt_tokens)
+        if response is None:
+            self.metrics.increment("aurora_llm_failures_total")
+        return response
+
+    # Provider statistics are kept by the workers
+    def save_provider_stats(self, force: bool = False):
+        pass
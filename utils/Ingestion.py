@@ -0,0 +1,77 @@
+import asyncio
+import codecs
+import os
+import tempfile
+
+import aiohttp
+import discord
+
+
+class IngestionError(Exception):
+    pass
+
+
+class AttachmentIngestor:
+    CHUNK_SIZE = 64 * 1024  # Bytes read from the download and written to disk at a time
+    DEFAULT_MAX_BYTES = 256 * 1024
+    ENCODING = "utf-8"
+    PARTIAL_SUFFIX = ".part"
+
+    def __init__(self, staging_path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        # Downloads are written to the staging directory first. It must be on the same drive as the destinations,
+        # so that the finished file can be renamed into place.
+        self.staging_path = staging_path
+        self.max_bytes = max_bytes
+        os.makedirs(staging_path, exist_ok=True)
+        # Removes downloads that were cut short by a restart
+        for entry in os.scandir(staging_path):
+            if entry.is_file() and entry.name.endswith(AttachmentIngestor.PARTIAL_SUFFIX):
+                os.remove(entry.path)
+
+    async def ingest(self, attachment: discord.Attachment, directory: str) -> str:
+        # Streams the attachment into directory under its own file name. The file only appears once it was fully
+        # downloaded and decoded. Returns the path of the file. Raises IngestionError with a reason fit for the user.
+        file_name = os.path.basename(attachment.filename)
+        destination = os.path.join(directory, file_name)
+        if not file_name:
+            raise IngestionError("The file has no name.")
+        if os.path.exists(destination):
+            raise IngestionError(f"{attachment.filename} already exists.")
+        if attachment.size > self.max_bytes:
+            raise IngestionError(f"The file is larger than {self.max_bytes // 1024} KB.")
+
+        descriptor, temp_path = tempfile.mkstemp(dir=self.staging_path, suffix=AttachmentIngestor.PARTIAL_SUFFIX)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                await self._download(attachment.url, file)
+            if os.path.exists(destination):
+                raise IngestionError(f"{attachment.filename} already exists.")
+            os.replace(temp_path, destination)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return destination
+
+    async def _download(self, url: str, file):
+        # Checks the size and encoding while the chunks arrive, so a bad file is dropped as early as possible
+        decoder = codecs.getincrementaldecoder(AttachmentIngestor.ENCODING)()
+        received = 0
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(AttachmentIngestor.CHUNK_SIZE):
+                        received += len(chunk)
+                        # The attachment size is reported by discord, the download is checked as well
+                        if received > self.max_bytes:
+                            raise IngestionError(f"The file is larger than {self.max_bytes // 1024} KB.")
+                        decoder.decode(chunk)
+                        await asyncio.to_thread(file.write, chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise IngestionError(f"The file is not {AttachmentIngestor.ENCODING} text.")
+        except aiohttp.ClientError as e:
+            raise IngestionError(f"The download failed. {str(e)}")
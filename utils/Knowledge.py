@@ -0,0 +1,180 @@
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+try:
+    # Optional, only needed to ingest pdf documents
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+
+class KnowledgeIndex:
+    INDEX_FILE_NAME = "knowledge_index.json"
+    SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf")
+
+    CHUNK_WORDS = 120  # Words per chunk
+    CHUNK_OVERLAP = 30  # Words shared by consecutive chunks so that sentences are not cut off
+    DEFAULT_TOP_K = 3
+    DEFAULT_REFRESH_INTERVAL = 10.0  # Minimum seconds between two scans of the knowledge directory
+
+    # BM25 parameters
+    K1 = 1.5
+    B = 0.75
+
+    TERM_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+    STOP_WORDS = frozenset((
+        "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "for", "from", "has", "have", "he", "her", "his",
+        "i", "if", "in", "is", "it", "its", "me", "my", "of", "on", "or", "she", "so", "that", "the", "their", "them",
+        "they", "this", "to", "was", "we", "were", "what", "with", "you", "your"))
+
+    def __init__(self, knowledge_path: str, index_file_path: str, top_k: int = DEFAULT_TOP_K,
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.knowledge_path = knowledge_path
+        self.index_file_path = index_file_path
+        self.top_k = top_k
+        self.refresh_interval = refresh_interval
+
+        # TFile_Name(str): {"mtime": float, "size": int, "chunks": [str]}
+        self.files: Dict[str, dict] = {}
+        # Search structures, replaced as a whole on rebuild so that lookups never see a half built index
+        # (chunk texts, chunk lengths, average chunk length, {term: [(chunk index, term frequency)]})
+        self.index: Tuple[List[str], List[int], float, Dict[str, List[Tuple[int, int]]]] = ([], [], 0.0, {})
+        self.last_refresh = 0.0
+        self.refresh_task: Optional[asyncio.Future] = None
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.index[0])
+
+    # Splits text into lowercase search terms
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return [term for term in KnowledgeIndex.TERM_PATTERN.findall(text.lower())
+                if term not in KnowledgeIndex.STOP_WORDS]
+
+    def search(self, query: str, top_k: Optional[int] = None) -> List[str]:
+        # Gets the chunks that are most relevant to the query, best first
+        chunks, lengths, average_length, postings = self.index
+        if not chunks:
+            return []
+        scores: Dict[int, float] = {}
+        for term in set(KnowledgeIndex.tokenize(query)):
+            term_postings = postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1.0 + (len(chunks) - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for chunk_index, frequency in term_postings:
+                length_ratio = lengths[chunk_index] / average_length
+                normalization = KnowledgeIndex.K1 * (1.0 - KnowledgeIndex.B + KnowledgeIndex.B * length_ratio)
+                scores[chunk_index] = scores.get(chunk_index, 0.0) + \
+                    idf * frequency * (KnowledgeIndex.K1 + 1.0) / (frequency + normalization)
+        best = sorted(scores, key=scores.get, reverse=True)[:top_k or self.top_k]
+        return [chunks[chunk_index] for chunk_index in best]
+
+    def schedule_refresh(self):
+        # Rescans the knowledge directory in the background, at most once per refresh interval
+        if self.refresh_task is not None and not self.refresh_task.done():
+            return
+        if time.monotonic() - self.last_refresh < self.refresh_interval:
+            return
+        self.last_refresh = time.monotonic()
+        self.refresh_task = asyncio.ensure_future(asyncio.to_thread(self.refresh))
+        self.refresh_task.add_done_callback(self._log_refresh_error)
+
+    def refresh(self) -> bool:
+        # Re-ingests the documents that were added, changed or removed. Returns true if the index changed.
+        if not os.path.isdir(self.knowledge_path):
+            return False
+        current = {}
+        for entry in os.scandir(self.knowledge_path):
+            if entry.is_file() and entry.name.lower().endswith(KnowledgeIndex.SUPPORTED_EXTENSIONS):
+                stat = entry.stat()
+                current[entry.name] = (stat.st_mtime, stat.st_size)
+
+        files = dict(self.files)
+        changed = False
+        for name in list(files):
+            if name not in current:
+                del files[name]
+                changed = True
+        for name, (mtime, size) in current.items():
+            known = files.get(name)
+            if known is not None and known["mtime"] == mtime and known["size"] == size:
+                continue
+            try:
+                text = self.read_document(os.path.join(self.knowledge_path, name))
+            except Exception as e:
+                print(f"[ERROR] Failed to ingest knowledge document {name}. {str(e)}")
+                continue
+            files[name] = {"mtime": mtime, "size": size, "chunks": self.chunk_text(text)}
+            changed = True
+
+        if changed:
+            self.files = files
+            self.rebuild()
+            self.save()
+            print(f"[SYSTEM] Indexed {len(self)} knowledge chunks from {len(files)} documents.")
+        return changed
+
+    def read_document(self, path: str) -> str:
+        if path.lower().endswith(".pdf"):
+            if PdfReader is None:
+                raise RuntimeError("pypdf is not installed")
+            return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            return file.read()
+
+    def chunk_text(self, text: str) -> List[str]:
+        words = text.split()
+        step = KnowledgeIndex.CHUNK_WORDS - KnowledgeIndex.CHUNK_OVERLAP
+        chunks = []
+        for start in range(0, max(1, len(words) - KnowledgeIndex.CHUNK_OVERLAP), step):
+            chunk = " ".join(words[start:start + KnowledgeIndex.CHUNK_WORDS])
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def rebuild(self):
+        # Builds the inverted index over the chunks of all documents
+        chunks, lengths, postings = [], [], {}
+        for name in sorted(self.files):
+            for chunk in self.files[name]["chunks"]:
+                terms = KnowledgeIndex.tokenize(chunk)
+                chunk_index = len(chunks)
+                chunks.append(chunk)
+                lengths.append(len(terms))
+                for term, frequency in Counter(terms).items():
+                    postings.setdefault(term, []).append((chunk_index, frequency))
+        average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self.index = (chunks, lengths, max(average_length, 1.0), postings)
+
+    def load(self):
+        # Loads the chunks of the previous run so documents do not have to be parsed again
+        try:
+            if os.path.exists(self.index_file_path):
+                with open(self.index_file_path, "r") as file:
+                    self.files = json.load(file)
+                self.rebuild()
+        except Exception as e:
+            print(f"[ERROR] Failed to load knowledge index. {str(e)}")
+            self.files = {}
+
+    def save(self):
+        try:
+            temp_path = self.index_file_path + ".tmp"
+            with open(temp_path, "w") as file:
+                json.dump(self.files, file)
+            os.replace(temp_path, self.index_file_path)
+        except Exception as e:
+            print(f"[ERROR] Failed to save knowledge index. {str(e)}")
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[ERROR] Failed to refresh knowledge index. {str(task.exception())}")
@@ -1,23 +1,108 @@
-from typing import Optional, List
+import asyncio
+import os
+import threading
+import time
+from typing import Optional, List, Tuple, Callable, Awaitable, Dict
 
-from tiktoken import get_encoding
-from g4f import ChatCompletion, models
-from g4f.Provider import (Bard, H2o)  # NON-GPT
+from utils.Dispatch import CircuitBreakerRegistry
+from utils.ProviderHealth import ProviderHealthRegistry
+from utils.Routing import RoutingTable
+from utils.Metrics import Metrics
 
-# Information about each provider
-# https://github.com/xtekky/gpt4free#gpt-35--gpt-4
-from g4f.Provider import (Bing, AItianhu, Acytoo, AiAsk, Chatgpt4Online, ChatgptDemo, ChatBase, ChatgptAi, ChatgptLogin, Aivvm, CodeLinkAva, DeepAi,
-                          GptGo, Vitalentum, Wewordle, Ylokh, You, Yqcloud)
+
+class InvalidResponseError(Exception):
+    pass
 
 
 class LLM:
-    TOKEN_COUNT_THRESHOLD = 3900
+    TOKEN_COUNT_THRESHOLD = RoutingTable.DEFAULT_MAX_TOKENS  # Prompt limit of providers missing from the routing table
     RETRY_COUNT = 3  # LLM request max retry count
+    HEDGE_WIDTH = 3  # Number of providers raced at the same time
+    PROVIDER_TIMEOUT = 30.0  # Seconds a single provider is given to respond
+    PROVIDER_STATS_FILE_NAME = "provider_stats.json"
+    MAX_RESPONSE_LENGTH = 20000  # Longer responses are runaway generations. Long ones are split when sent.
+    INVALID_RESPONSE_MARKERS = ["sorry, your app version is outdated.", "chatbase"]
+    TOKEN_COUNT_KEY = "token_count"  # Key under which a message's token count is cached
+    ROLE_TOKEN_CACHE_SIZE = 64  # Number of distinct role texts whose token counts are cached
+    ENCODING_NAME = "cl100k_base"
+
+    # Information about each provider
+    # https://github.com/xtekky/gpt4free#gpt-35--gpt-4
+    PROVIDER_NAMES = ["Bing", "AItianhu", "Acytoo", "AiAsk", "Chatgpt4Online", "ChatgptDemo", "ChatBase", "ChatgptAi",
+                      "ChatgptLogin", "Aivvm", "CodeLinkAva", "DeepAi", "GptGo", "Vitalentum", "Wewordle", "Ylokh", "You",
+                      "Yqcloud"]
+    NON_GPT_PROVIDER_NAMES = ["Bard", "H2o"]
+
+    def __init__(self, hedge_width: int = HEDGE_WIDTH, provider_timeout: float = PROVIDER_TIMEOUT,
+                 stats_file_path: Optional[str] = None, metrics: Optional[Metrics] = None,
+                 encoding_cache_path: Optional[str] = None, routing_file_path: Optional[str] = None):
+        # The tokenizer and the g4f providers are slow to import, they are loaded on first use or by prewarm()
+        self._tokenizer = None
+        self._providers = None
+        self.load_lock = threading.Lock()
+        # TComponent(str): seconds it took to load
+        self.load_times: Dict[str, float] = {}
+        # Keeps the downloaded encoding files next to the bot data so that restarts do not download them again
+        if encoding_cache_path is not None:
+            os.environ.setdefault("TIKTOKEN_CACHE_DIR", encoding_cache_path)
+        self.hedge_width = max(1, hedge_width)
+        self.provider_timeout = provider_timeout
+        # Stops sending requests to providers that keep failing
+        self.breakers = CircuitBreakerRegistry()
+        # Live latency and success statistics used to order the providers
+        self.health = ProviderHealthRegistry(stats_file_path)
+        # Prompt token limits and models of the providers, and the prompt size classes
+        self.routing = RoutingTable(routing_file_path, LLM.TOKEN_COUNT_THRESHOLD)
+        self.last_stats_save = time.monotonic()
+        # TRole_Text(str): token count(int)
+        self.role_token_cache = {}
+        # TProvider_Name(str): monotonic time of the last finished request
+        self.last_attempt_times: Dict[str, float] = {}
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            with self.load_lock:
+                if self._tokenizer is None:
+                    start_time = time.perf_counter()
+                    from tiktoken import get_encoding
+                    self._tokenizer = get_encoding(LLM.ENCODING_NAME)
+                    self.load_times["tokenizer"] = time.perf_counter() - start_time
+        return self._tokenizer
+
+    @property
+    def providers(self) -> list:
+        # Importing g4f imports every provider module, so it is only done once the providers are needed
+        if self._providers is None:
+            with self.load_lock:
+                if self._providers is None:
+                    start_time = time.perf_counter()
+                    import g4f
+                    import g4f.Provider
+                    print("g4f Package Version: ", g4f.version)
+                    self._providers = [getattr(g4f.Provider, name) for name in LLM.PROVIDER_NAMES
+                                       if hasattr(g4f.Provider, name)]
+                    self.load_times["providers"] = time.perf_counter() - start_time
+        return self._providers
 
-    def __init__(self):
-        self.tokenizer = get_encoding("cl100k_base")
-        self.providers = [Bing, AItianhu, Acytoo, AiAsk, Chatgpt4Online, ChatgptDemo, ChatBase, ChatgptAi, ChatgptLogin, Aivvm, CodeLinkAva, DeepAi,
-                          GptGo, Vitalentum, Wewordle, Ylokh, You, Yqcloud]
+    @providers.setter
+    def providers(self, providers: list):
+        self._providers = providers
+
+    # Loads the tokenizer and the providers off the event loop thread, so that the first request does not wait
+    async def prewarm(self, load_providers: bool = True):
+        def load():
+            self.count_tokens("prewarm")
+            if load_providers:
+                _ = self.providers
+        await asyncio.to_thread(load)
+
+    # Loads the providers off the event loop thread if they are not loaded yet. Requests call this before touching
+    # self.providers, so that they never wait for the import while holding up the event loop.
+    async def ensure_providers_loaded(self):
+        if self._providers is None:
+            await asyncio.to_thread(lambda: self.providers)
 
     # async def LLM_get_response(self, all_messages_raw: List[dict]) -> Optional[str]:
     #     try:
@@ -33,39 +118,272 @@ class LLM:
     #     # Failed to get a response
     #     return None
 
-    async def LLM_get_response(self, all_messages_raw: List[dict]) -> Optional[str]:
-        # Iterates over every provider until one of them gets a valid response
-        for _ in range(LLM.RETRY_COUNT):
-            for provider in self.providers:
-                if not provider.working:
-                    continue
-                try:
-                    # Retrieves response from g4f provider
-                    response = await ChatCompletion.create_async(model=models.default, messages=all_messages_raw,
-                                                                     provider=provider)
-                    if self.determine_if_valid_response(response):
+    async def LLM_get_response(self, all_messages_raw: List[dict],
+                               prompt_tokens: Optional[int] = None) -> Optional[str]:
+        # Races the request against several providers and returns the first valid response.
+        # With the prompt's token count, only providers that accept a prompt of that size are tried.
+        size_class = self.routing.size_class(prompt_tokens)
+        await self.ensure_providers_loaded()
+        with self.metrics.timer("aurora_llm_response_seconds"):
+            for _ in range(LLM.RETRY_COUNT):
+                response = await self.race_providers(all_messages_raw, self.get_candidate_providers(prompt_tokens),
+                                                     size_class)
+                if response is not None:
+                    self.save_provider_stats()
+                    return response
+
+        # Failed to get a response
+        self.metrics.increment("aurora_llm_failures_total")
+        self.save_provider_stats()
+        return None
+
+    # Gets the providers that are currently worth sending a request to, healthiest first.
+    # Providers are ranked by how they did on prompts of the same size.
+    def get_candidate_providers(self, prompt_tokens: Optional[int] = None) -> list:
+        available = [provider for provider in self.providers
+                     if provider.working and not self.breakers.is_open(provider.__name__)]
+        if prompt_tokens is not None:
+            fitting = [provider for provider in available
+                       if self.routing.get_max_tokens(provider.__name__) >= prompt_tokens]
+            # Better to try a provider that may cut the prompt than none at all
+            available = fitting or available
+        return self.health.rank(available, self.routing.size_class(prompt_tokens))
+
+    # Gets the largest prompt, in tokens, that one of the available providers accepts
+    def get_token_budget(self) -> int:
+        if self._providers is None:
+            # Does not load the providers just to answer this
+            return self.routing.get_token_budget(LLM.PROVIDER_NAMES)
+        return self.routing.get_token_budget(provider.__name__ for provider in self._providers
+                                             if provider.working and not self.breakers.is_open(provider.__name__))
+
+    # Gets the g4f model requested from the provider
+    def get_model(self, provider):
+        from g4f import models
+        model_name = self.routing.get_model_name(provider.__name__)
+        if model_name is None:
+            return models.default
+        return models.ModelUtils.convert.get(model_name, models.default)
+
+    # Persists provider statistics in the background, at most once every SAVE_INTERVAL seconds
+    def save_provider_stats(self, force: bool = False):
+        if not force and time.monotonic() - self.last_stats_save < ProviderHealthRegistry.SAVE_INTERVAL:
+            return
+        self.last_stats_save = time.monotonic()
+        snapshot = self.health.snapshot()
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self.health.save, snapshot)
+        except RuntimeError:
+            self.health.save(snapshot)
+
+    async def race_providers(self, all_messages_raw: List[dict], candidates: list,
+                             size_class: Optional[str] = None) -> Optional[str]:
+        # Keeps up to hedge_width provider requests in flight. Whenever one fails, the next candidate takes its place.
+        candidates = list(candidates)
+        in_flight = {}
+        try:
+            while candidates or in_flight:
+                while candidates and len(in_flight) < self.hedge_width:
+                    provider = candidates.pop(0)
+                    if not self.breakers.get(provider.__name__).allow_request():
+                        continue
+                    task = asyncio.create_task(self.request_provider(provider, all_messages_raw, size_class))
+                    in_flight[task] = provider
+                if not in_flight:
+                    break
+
+                done, _ = await asyncio.wait(in_flight.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = in_flight.pop(task)
+                    response = task.result()
+                    if response is not None:
                         print(f"\tSUCCESS with PROVIDER: {provider.__name__}")
                         return response
-                except Exception as e:
-                    print(f"\tPROVIDER: {provider.__name__} \tERROR: {str(e)}")
-                    pass
+        finally:
+            # Cancels the slower providers once there is a winner
+            for task, provider in in_flight.items():
+                task.cancel()
+                self.breakers.get(provider.__name__).release()
 
-        # Failed to get a response
         return None
 
+    async def request_provider(self, provider, all_messages_raw: List[dict],
+                               size_class: Optional[str] = None) -> Optional[str]:
+        # Retrieves a response from a single g4f provider. Returns None if it failed or was invalid.
+        breaker = self.breakers.get(provider.__name__)
+        start_time = time.perf_counter()
+        from g4f import ChatCompletion
+        try:
+            response = await asyncio.wait_for(
+                ChatCompletion.create_async(model=self.get_model(provider), messages=all_messages_raw,
+                                            provider=provider),
+                timeout=self.provider_timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"\tPROVIDER: {provider.__name__} \tERROR: Timed out after {self.provider_timeout}s")
+            breaker.record_failure()
+            self.health.record_failure(provider.__name__, "TimeoutError", time.perf_counter() - start_time,
+                                       size_class)
+            self.record_provider_attempt(provider, "timeout", start_time)
+            return None
+        except Exception as e:
+            print(f"\tPROVIDER: {provider.__name__} \tERROR: {str(e)}")
+            breaker.record_failure()
+            self.health.record_failure(provider.__name__, type(e).__name__, size_class=size_class)
+            self.record_provider_attempt(provider, "error", start_time)
+            return None
+
+        latency = time.perf_counter() - start_time
+        if not self.determine_if_valid_response(response):
+            breaker.record_failure()
+            self.health.record_invalid(provider.__name__, latency, size_class)
+            self.record_provider_attempt(provider, "invalid", start_time)
+            return None
+        breaker.record_success()
+        self.health.record_success(provider.__name__, latency, size_class)
+        self.record_provider_attempt(provider, "success", start_time)
+        return response
+
+    def record_provider_attempt(self, provider, outcome: str, start_time: float):
+        self.last_attempt_times[provider.__name__] = time.monotonic()
+        self.metrics.observe("aurora_provider_attempt_seconds", time.perf_counter() - start_time,
+                             provider=provider.__name__, outcome=outcome)
+        self.metrics.increment("aurora_provider_attempts_total", provider=provider.__name__, outcome=outcome)
+
     def determine_if_valid_response(self, response: Optional[str]) -> bool:
         # Determines if the response from the LLM is invalid. This will use heuristic rules.
-        if response is None or len(response) == 0 or len(response) > 1980:
+        if response is None or len(response) == 0:
             return False
-        if response.lower().find("sorry, your app version is outdated.") != -1:
-            return False
-        if response.lower().find("chatbase") != -1:
+
+        return self.determine_if_valid_partial_response(response)
+
+    def determine_if_valid_partial_response(self, response: str) -> bool:
+        # Same heuristic rules, applied to a response that is still being streamed
+        if len(response) > LLM.MAX_RESPONSE_LENGTH:
             return False
+        lowered_response = response.lower()
+        for marker in LLM.INVALID_RESPONSE_MARKERS:
+            if lowered_response.find(marker) != -1:
+                return False
 
         return True
 
-    # Gets the number of total tokens that a message has
-    def compute_messages_token_count(self, all_messages_raw: List[dict]) -> int:
-        combined_str = ' '.join(message["content"] for message in all_messages_raw)
-        return len(self.tokenizer.encode(combined_str))
+    async def LLM_stream_response(self, all_messages_raw: List[dict], on_update: Callable[[str], Awaitable[None]],
+                                  prompt_tokens: Optional[int] = None) -> Optional[str]:
+        # Streams the response of the healthiest provider that supports streaming. on_update receives the text so far.
+        # If a provider fails midway, the next one restarts the text from the beginning.
+        size_class = self.routing.size_class(prompt_tokens)
+        await self.ensure_providers_loaded()
+        for provider in self.get_candidate_providers(prompt_tokens):
+            if not getattr(provider, "supports_stream", False) or not hasattr(provider, "create_async_generator"):
+                continue
+            if not self.breakers.get(provider.__name__).allow_request():
+                continue
+            response = await self.stream_provider(provider, all_messages_raw, on_update, size_class)
+            if response is not None:
+                print(f"\tSUCCESS with PROVIDER: {provider.__name__} (streamed)")
+                self.save_provider_stats()
+                return response
+
+        # No provider could stream a response, waits for a full one instead
+        return await self.LLM_get_response(all_messages_raw, prompt_tokens)
+
+    async def stream_provider(self, provider, all_messages_raw: List[dict], on_update: Callable[[str], Awaitable[None]],
+                              size_class: Optional[str] = None) -> Optional[str]:
+        # Streams a response from a single g4f provider. Each chunk must arrive within the provider timeout.
+        breaker = self.breakers.get(provider.__name__)
+        start_time = time.perf_counter()
+        response = ""
+        generator = provider.create_async_generator(self.get_model(provider).name, all_messages_raw)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(generator.__anext__(), timeout=self.provider_timeout)
+                except StopAsyncIteration:
+                    break
+                response += str(chunk)
+                if not self.determine_if_valid_partial_response(response):
+                    raise InvalidResponseError("Failed Valid Response Check.")
+                await on_update(response)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            print(f"\tPROVIDER: {provider.__name__} \tERROR: Timed out after {self.provider_timeout}s")
+            breaker.record_failure()
+            self.health.record_failure(provider.__name__, "TimeoutError", time.perf_counter() - start_time,
+                                       size_class)
+            self.record_provider_attempt(provider, "timeout", start_time)
+            return None
+        except Exception as e:
+            print(f"\tPROVIDER: {provider.__name__} \tERROR: {str(e)}")
+            breaker.record_failure()
+            if isinstance(e, InvalidResponseError):
+                self.health.record_invalid(provider.__name__, time.perf_counter() - start_time, size_class)
+                self.record_provider_attempt(provider, "invalid", start_time)
+            else:
+                self.health.record_failure(provider.__name__, type(e).__name__, size_class=size_class)
+                self.record_provider_attempt(provider, "error", start_time)
+            return None
+        finally:
+            await generator.aclose()
+
+        latency = time.perf_counter() - start_time
+        if not self.determine_if_valid_response(response):
+            breaker.record_failure()
+            self.health.record_invalid(provider.__name__, latency, size_class)
+            self.record_provider_attempt(provider, "invalid", start_time)
+            return None
+        breaker.record_success()
+        self.health.record_success(provider.__name__, latency, size_class)
+        self.record_provider_attempt(provider, "success", start_time)
+        return response
+
+    # Gets the number of tokens in a string
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
+
+    # Tokenizes off the event loop thread
+    async def count_tokens_async(self, text: str) -> int:
+        return await asyncio.to_thread(self.count_tokens, text)
+
+    # Gets the token count of a role text. Role texts are shared by many requests, so they are only tokenized once.
+    async def count_role_tokens_async(self, role: str) -> int:
+        if role not in self.role_token_cache:
+            if len(self.role_token_cache) >= LLM.ROLE_TOKEN_CACHE_SIZE:
+                self.role_token_cache.clear()
+            self.role_token_cache[role] = await self.count_tokens_async(role)
+        return self.role_token_cache[role]
+
+    # Creates a message that carries its own token count
+    async def create_message(self, role: str, content: str) -> dict:
+        return {"role": role, "content": content, LLM.TOKEN_COUNT_KEY: await self.count_tokens_async(content)}
+
+    # Computes the token counts of messages that do not have one yet (ex: history saved by older versions)
+    async def ensure_token_counts(self, messages: List[dict]):
+        missing = [message for message in messages if LLM.TOKEN_COUNT_KEY not in message]
+        if not missing:
+            return
+
+        def count_missing():
+            for message in missing:
+                message[LLM.TOKEN_COUNT_KEY] = self.count_tokens(message["content"])
+        await asyncio.to_thread(count_missing)
+
+    # Drops the oldest messages until the prompt fits in the token budget. Returns the kept messages and their total.
+    @staticmethod
+    def trim_messages_to_budget(messages: List[dict], reserved_tokens: int,
+                                budget: int = TOKEN_COUNT_THRESHOLD) -> Tuple[List[dict], int]:
+        total = reserved_tokens + sum(message[LLM.TOKEN_COUNT_KEY] for message in messages)
+        start = 0
+        while total > budget and start < len(messages):
+            total -= messages[start][LLM.TOKEN_COUNT_KEY]
+            start += 1
+        return messages[start:], total
+
+    # Removes the cached token counts so that only the fields the providers understand are sent
+    @staticmethod
+    def strip_token_counts(messages: List[dict]) -> List[dict]:
+        return [{"role": message["role"], "content": message["content"]} for message in messages]
 
@@ -0,0 +1,24 @@
+import datetime
+import random
+from typing import Optional, Tuple
+
+
+class HumanizedLatencyPolicy:
+    DEFAULT_MIN_RESPONSE_TIME = (2.0, 5.0)  # Range of the minimum perceived response time, in seconds
+
+    def __init__(self, min_response_time: Optional[Tuple[float, float]] = DEFAULT_MIN_RESPONSE_TIME):
+        # None switches the policy off, replies are then sent as soon as they are ready
+        self.min_response_time = min_response_time
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_response_time is not None and self.min_response_time[1] > 0
+
+    def remaining_delay(self, received_at: datetime.datetime) -> float:
+        # Seconds to hold a reply so that it does not arrive faster than a person would answer.
+        # Time already spent waiting in the queue or generating the response counts towards it.
+        if not self.enabled:
+            return 0.0
+        target = random.uniform(*self.min_response_time)
+        elapsed = (datetime.datetime.now(datetime.timezone.utc) - received_at).total_seconds()
+        return max(0.0, target - elapsed)
@@ -0,0 +1,200 @@
+import asyncio
+import random
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Per bucket counts, the last slot counts observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        # Approximates a quantile with the upper bound of the bucket it falls in
+        if self.count == 0:
+            return None
+        rank = quantile * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    DEFAULT_SAMPLE_RATE = 1.0  # Fraction of timings recorded in histograms, counters are always exact
+
+    def __init__(self, enabled: bool = True, sample_rate: float = DEFAULT_SAMPLE_RATE):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        # Metrics are also recorded from persistence and tokenizer threads
+        self.lock = threading.Lock()
+        # TMetric_Name(str): help text(str)
+        self.descriptions: Dict[str, str] = {}
+        # TMetric_Name(str): {labels(tuple): value}
+        self.counters: Dict[str, Dict[tuple, float]] = {}
+        self.histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        # TMetric_Name(str): function returning the current value
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def describe(self, name: str, description: str):
+        self.descriptions[name] = description
+
+    def increment(self, name: str, value: float = 1.0, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def gauge(self, name: str, function: Callable[[], float]):
+        # Registers a gauge that is read when the metrics are collected
+        self.gauges[name] = function
+
+    def timer(self, name: str, **labels) -> "Timer":
+        # Context manager that observes the duration of its body in seconds
+        return Timer(self, name, labels)
+
+    def get_counter(self, name: str, **labels) -> float:
+        return self.counters.get(name, {}).get(tuple(sorted(labels.items())), 0.0)
+
+    def get_histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self.histograms.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def render_prometheus(self) -> str:
+        # Renders all metrics in the prometheus text exposition format
+        lines = []
+        counters, histograms = self._snapshot()
+        for name, series in sorted(counters.items()):
+            self._render_header(lines, name, "counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for name, function in sorted(self.gauges.items()):
+            self._render_header(lines, name, "gauge")
+            try:
+                lines.append(f"{name} {float(function())}")
+            except Exception as e:
+                print(f"[ERROR] Failed to read gauge {name}. {str(e)}")
+        for name, series in sorted(histograms.items()):
+            self._render_header(lines, name, "histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bucket, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels(labels + (('le', bucket),))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def render_summary(self) -> str:
+        # Renders a short human readable summary
+        lines = []
+        counters, histograms = self._snapshot()
+        for name, function in sorted(self.gauges.items()):
+            try:
+                lines.append(f"{name}: {float(function()):g}")
+            except Exception:
+                pass
+        for name, series in sorted(counters.items()):
+            total = sum(series.values())
+            lines.append(f"{name}: {total:g}")
+        for name, series in sorted(histograms.items()):
+            # Merges the labelled series of the histogram
+            merged = Histogram()
+            for histogram in series.values():
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+            if merged.count == 0:
+                continue
+            lines.append(f"{name}: n={merged.count} avg={merged.sum / merged.count:.3f}s "
+                         f"p50<={merged.quantile(0.5):g}s p95<={merged.quantile(0.95):g}s")
+        return "\n".join(lines)
+
+    async def start_http_server(self, host: str, port: int) -> asyncio.AbstractServer:
+        # Serves the metrics at http://host:port/metrics
+        return await asyncio.start_server(self._handle_http_request, host, port)
+
+    async def _handle_http_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            # Skips the headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split(" ")
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render_prometheus()
+            else:
+                status, body = "404 Not Found", "Not Found\n"
+            body_bytes = body.encode("utf-8")
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body_bytes)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            writer.write(body_bytes)
+            await writer.drain()
+        except Exception as e:
+            print(f"[ERROR] Failed to serve metrics request. {str(e)}")
+        finally:
+            writer.close()
+
+    def _snapshot(self) -> tuple:
+        # Copies the series so that other threads can keep recording while rendering
+        with self.lock:
+            return ({name: dict(series) for name, series in self.counters.items()},
+                    {name: dict(series) for name, series in self.histograms.items()})
+
+    def _render_header(self, lines: List[str], name: str, metric_type: str):
+        if name in self.descriptions:
+            lines.append(f"# HELP {name} {self.descriptions[name]}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    @staticmethod
+    def _format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Timer:
+    def __init__(self, metrics: Metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start_time = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.observe(self.name, time.perf_counter() - self.start_time, **self.labels)
+        return False
@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import random
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import discord
+
+from utils.Admission import TokenBucket
+from utils.Chunking import MESSAGE_LENGTH_LIMIT
+from utils.Metrics import Metrics
+
+
+class Delivery:
+    def __init__(self, send: Callable[..., Awaitable[Any]], content: Optional[str], priority: int,
+                 reference: Optional[discord.Message], file: Optional[discord.File]):
+        # Coroutine function that performs the send (channel.send or author.send)
+        self.send = send
+        self.content = content
+        self.priority = priority
+        self.reference = reference
+        self.file = file
+        self.future: Optional[asyncio.Future] = None
+
+
+class OutboundQueue:
+    PRIORITY_REPLY = 0  # Conversation replies go out first
+    PRIORITY_COMMAND = 1
+
+    GLOBAL_RATE = 45.0  # Requests per second across all routes, discord allows 50
+    ROUTE_RATE = 1.0  # Messages per second per channel once the burst is used up, discord allows 5 per 5 seconds
+    ROUTE_BURST = 5
+    MAX_RETRIES = 5
+    MAX_RETRY_DELAY = 30.0
+    MERGE_SEPARATOR = "\n"
+    MAX_ROUTE_BUCKETS = 10000  # Idle route buckets are pruned once there are more than this
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, route_rate: float = ROUTE_RATE,
+                 route_burst: int = ROUTE_BURST, max_retries: int = MAX_RETRIES, metrics: Optional[Metrics] = None):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self.max_retries = max_retries
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        # TRoute(hashable): heap of (priority, sequence, Delivery)
+        self.routes: Dict[Hashable, list] = {}
+        # TRoute(hashable): TokenBucket, kept between drains so that the burst is only refilled over time
+        self.route_buckets: Dict[Hashable, TokenBucket] = {}
+        # TRoute(hashable): task that drains the route
+        self.route_tasks: Dict[Hashable, asyncio.Task] = {}
+        self.sequence = count()
+
+    def queue_depth(self) -> int:
+        return sum(len(deliveries) for deliveries in self.routes.values())
+
+    async def send(self, route: Hashable, send: Callable[..., Awaitable[Any]], content: Optional[str],
+                   priority: int = PRIORITY_COMMAND, reference: Optional[discord.Message] = None,
+                   file: Optional[discord.File] = None) -> Optional[discord.Message]:
+        # Queues the message behind the other deliveries of its route and waits until it was sent.
+        # Returns None if it could not be delivered.
+        delivery = Delivery(send, content, priority, reference, file)
+        delivery.future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.routes.setdefault(route, []), (priority, next(self.sequence), delivery))
+        if route not in self.route_tasks:
+            self.route_tasks[route] = asyncio.create_task(self._drain(route))
+        return await asyncio.shield(delivery.future)
+
+    async def _drain(self, route: Hashable):
+        # Sends the deliveries of a route one at a time, in priority and then arrival order
+        deliveries = self.routes[route]
+        bucket = self._get_route_bucket(route)
+        try:
+            while deliveries:
+                await self._wait_for_token(bucket)
+                await self._wait_for_token(self.global_bucket)
+                batch = self._take_batch(deliveries)
+                sent_message = await self._deliver(batch[0])
+                for delivery in batch:
+                    if not delivery.future.done():
+                        delivery.future.set_result(sent_message)
+        finally:
+            # Cancelled with work left, nothing will send it anymore
+            for _, _, delivery in deliveries:
+                if not delivery.future.done():
+                    delivery.future.set_result(None)
+            del self.route_tasks[route]
+            del self.routes[route]
+
+    def _get_route_bucket(self, route: Hashable) -> TokenBucket:
+        bucket = self.route_buckets.get(route)
+        if bucket is None:
+            if len(self.route_buckets) >= OutboundQueue.MAX_ROUTE_BUCKETS:
+                # Full buckets behave exactly like new ones, so they can be dropped
+                for idle_route in [idle_route for idle_route, idle_bucket in self.route_buckets.items()
+                                   if idle_bucket.is_full()]:
+                    del self.route_buckets[idle_route]
+            bucket = self.route_buckets[route] = TokenBucket(self.route_rate, self.route_burst)
+        return bucket
+
+    def _take_batch(self, deliveries: list) -> List[Delivery]:
+        # Merges short command responses that are waiting on the same route into a single message
+        first = heapq.heappop(deliveries)[2]
+        batch = [first]
+        if first.priority != OutboundQueue.PRIORITY_COMMAND or first.file is not None or first.content is None:
+            return batch
+        while deliveries:
+            following = deliveries[0][2]
+            if following.priority != first.priority or following.file is not None or following.content is None:
+                break
+            merged_content = first.content + OutboundQueue.MERGE_SEPARATOR + following.content
+            if len(merged_content) > MESSAGE_LENGTH_LIMIT:
+                break
+            first.content = merged_content
+            batch.append(heapq.heappop(deliveries)[2])
+        if len(batch) > 1:
+            self.metrics.increment("aurora_send_merged_total", len(batch) - 1)
+        return batch
+
+    async def _deliver(self, delivery: Delivery) -> Optional[discord.Message]:
+        kwargs = {"reference": delivery.reference}
+        for attempt in range(self.max_retries + 1):
+            if delivery.file is not None:
+                kwargs["file"] = delivery.file
+                if attempt > 0:
+                    delivery.file.reset()
+            try:
+                with self.metrics.timer("aurora_send_seconds"):
+                    return await delivery.send(delivery.content, **kwargs)
+            except discord.HTTPException as e:
+                status = getattr(e, "status", None)
+                if status != 429 and (status is None or status < 500):
+                    print(f"[ERROR] Failed to send message. {str(e)}")
+                    break
+                # Rate limited or a server error, waits with jitter and tries again
+                retry_after = getattr(e, "retry_after", None) or min(2.0 ** attempt, OutboundQueue.MAX_RETRY_DELAY)
+                self.metrics.increment("aurora_send_retries_total", status=status)
+                await asyncio.sleep(retry_after + random.uniform(0.0, 0.5 * retry_after))
+            except Exception as e:
+                print(f"[ERROR] Failed to send message. {str(e)}")
+                break
+        self.metrics.increment("aurora_send_failures_total")
+        return None
+
+    @staticmethod
+    async def _wait_for_token(bucket: TokenBucket):
+        while not bucket.peek():
+            await asyncio.sleep((1.0 - bucket.tokens) / bucket.rate)
+        bucket.take()
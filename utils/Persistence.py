@@ -0,0 +1,185 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from utils.Storage import StorageBackend
+from utils.Metrics import Metrics
+
+
+class WriteBehindStorage(StorageBackend):
+    DEFAULT_FLUSH_WINDOW = 2.0  # Seconds that writes are coalesced for before they are flushed
+    DEFAULT_MAX_THREADS = 2  # Threads that perform the disk writes
+
+    def __init__(self, storage: StorageBackend, flush_window: float = DEFAULT_FLUSH_WINDOW,
+                 max_threads: int = DEFAULT_MAX_THREADS, metrics: Optional[Metrics] = None):
+        self.storage = storage
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.flush_window = flush_window
+        self.max_threads = max(1, max_threads)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="persistence")
+
+        # TServer_ID(str): [latest messages(list), appended since last flush(list) or None if replaced]
+        self.pending_messages: Dict[str, list] = {}
+        # TServer_ID(str): copy of the latest metadata(dict)
+        self.pending_metadata: Dict[str, dict] = {}
+        # Batch that is currently being written by the thread pool
+        self.in_flight: Optional[tuple] = None
+
+        self.flush_task: Optional[asyncio.Task] = None
+        self.flush_lock: Optional[asyncio.Lock] = None
+
+    def is_dirty(self, server_folder: str) -> bool:
+        if server_folder in self.pending_messages or server_folder in self.pending_metadata:
+            return True
+        return self.in_flight is not None and (server_folder in self.in_flight[0] or server_folder in self.in_flight[1])
+
+    def list_server_folders(self) -> List[str]:
+        server_folders = set(self.storage.list_server_folders())
+        server_folders.update(self.pending_messages.keys())
+        server_folders.update(self.pending_metadata.keys())
+        return list(server_folders)
+
+    def load_messages(self, server_folder: str) -> Optional[List[dict]]:
+        # Unflushed writes are newer than what is on disk
+        if server_folder in self.pending_messages:
+            return list(self.pending_messages[server_folder][0])
+        if self.in_flight is not None and server_folder in self.in_flight[0]:
+            return list(self.in_flight[0][server_folder][0])
+        return self.storage.load_messages(server_folder)
+
+    def load_metadata(self, server_folder: str) -> Optional[dict]:
+        if server_folder in self.pending_metadata:
+            return dict(self.pending_metadata[server_folder])
+        if self.in_flight is not None and server_folder in self.in_flight[1]:
+            return dict(self.in_flight[1][server_folder])
+        return self.storage.load_metadata(server_folder)
+
+    async def load_async(self, server_folder: str) -> Tuple[Optional[List[dict]], Optional[dict]]:
+        # Loads the messages and metadata. Reads from disk are performed on a worker thread.
+        if self.is_dirty(server_folder):
+            return self.load_messages(server_folder), self.load_metadata(server_folder)
+        return await asyncio.to_thread(
+            lambda: (self.storage.load_messages(server_folder), self.storage.load_metadata(server_folder)))
+
+    def save_messages(self, server_folder: str, messages: List[dict], appended: Optional[List[dict]] = None):
+        # Histories are replaced rather than mutated, so keeping a reference to the list is a consistent snapshot
+        entry = self.pending_messages.get(server_folder)
+        if entry is None:
+            self.pending_messages[server_folder] = [messages, list(appended) if appended is not None else None]
+        else:
+            entry[0] = messages
+            if entry[1] is not None and appended is not None:
+                entry[1].extend(appended)
+            else:
+                entry[1] = None
+        self._schedule_flush()
+
+    def save_metadata(self, server_folder: str, metadata: dict):
+        # Metadata is mutated in place, so a copy is kept
+        self.pending_metadata[server_folder] = dict(metadata)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (ex: during startup or shutdown), writes immediately
+            self._write_pending()
+            return
+
+        # Coalesces everything written within the flush window into one batch
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_window)
+        await self.flush()
+
+    async def flush(self):
+        # Writes all pending data in the thread pool. Batches are written one after another to keep them ordered.
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            if not self.pending_messages and not self.pending_metadata:
+                return
+            self.in_flight = (self.pending_messages, self.pending_metadata)
+            self.pending_messages, self.pending_metadata = {}, {}
+
+            loop = asyncio.get_running_loop()
+            writes = [loop.run_in_executor(self.executor, self._write_messages, server_folder, entry)
+                      for server_folder, entry in self.in_flight[0].items()]
+            writes += [loop.run_in_executor(self.executor, self._write_metadata, server_folder, metadata)
+                       for server_folder, metadata in self.in_flight[1].items()]
+            results = await asyncio.gather(*writes, return_exceptions=True)
+
+            # Failed writes are retried with the next batch as a full rewrite of the history
+            failed_messages, failed_metadata = self.in_flight
+            self.in_flight = None
+            failed = False
+            for server_folder, entry in failed_messages.items():
+                if results.pop(0) is True:
+                    continue
+                if server_folder in self.pending_messages:
+                    self.pending_messages[server_folder][1] = None
+                else:
+                    self.pending_messages[server_folder] = [entry[0], None]
+                failed = True
+            for server_folder, metadata in failed_metadata.items():
+                # Newer metadata already replaces a failed write
+                if results.pop(0) is not True and server_folder not in self.pending_metadata:
+                    self.pending_metadata[server_folder] = metadata
+                    failed = True
+        if failed:
+            self._schedule_flush()
+
+    def flush_sync(self):
+        # Writes everything that is pending from the calling thread. Used on shutdown.
+        self.executor.shutdown(wait=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="persistence")
+        if self.in_flight is not None:
+            # The loop stopped before the batch was confirmed. Rewriting it as a full history is idempotent.
+            for server_folder, entry in self.in_flight[0].items():
+                if server_folder in self.pending_messages:
+                    self.pending_messages[server_folder][1] = None
+                else:
+                    self.pending_messages[server_folder] = [entry[0], None]
+            for server_folder, metadata in self.in_flight[1].items():
+                self.pending_metadata.setdefault(server_folder, metadata)
+            self.in_flight = None
+        self._write_pending()
+
+    def _write_pending(self):
+        pending_messages, pending_metadata = self.pending_messages, self.pending_metadata
+        self.pending_messages, self.pending_metadata = {}, {}
+        for server_folder, entry in pending_messages.items():
+            self._write_messages(server_folder, entry)
+        for server_folder, metadata in pending_metadata.items():
+            self._write_metadata(server_folder, metadata)
+
+    def close(self):
+        self.flush_sync()
+        self.executor.shutdown(wait=True)
+        self.storage.close()
+
+    def pending_count(self) -> int:
+        return len(self.pending_messages) + len(self.pending_metadata)
+
+    def _write_messages(self, server_folder: str, entry: list) -> bool:
+        try:
+            with self.metrics.timer("aurora_persistence_write_seconds", kind="messages"):
+                self.storage.save_messages(server_folder, entry[0], entry[1])
+        except Exception as e:
+            print(f"[ERROR] Failed to write messages of {server_folder}. {str(e)}")
+            self.metrics.increment("aurora_persistence_failures_total", kind="messages")
+            return False
+        return True
+
+    def _write_metadata(self, server_folder: str, metadata: dict) -> bool:
+        try:
+            with self.metrics.timer("aurora_persistence_write_seconds", kind="metadata"):
+                self.storage.save_metadata(server_folder, metadata)
+        except Exception as e:
+            print(f"[ERROR] Failed to write metadata of {server_folder}. {str(e)}")
+            self.metrics.increment("aurora_persistence_failures_total", kind="metadata")
+            return False
+        return True
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from typing import Optional
+
+from utils.LLM import LLM
+
+
+class ProviderProber:
+    DEFAULT_INTERVAL = 300.0  # Seconds without traffic after which a provider is probed
+    CHECK_INTERVAL = 30.0  # Seconds between two looks for providers that are due for a probe
+    MAX_CONCURRENT_PROBES = 4
+    PROBE_MESSAGES = [{"role": "user", "content": "Reply with the single word OK."}]
+
+    def __init__(self, llm: LLM, interval: float = DEFAULT_INTERVAL, check_interval: float = CHECK_INTERVAL,
+                 max_concurrent_probes: int = MAX_CONCURRENT_PROBES):
+        # Probes whatever is in llm.providers, so tests can point it at stand-in providers
+        self.llm = llm
+        self.interval = interval
+        self.check_interval = check_interval
+        self.max_concurrent_probes = max_concurrent_probes
+        self.task: Optional[asyncio.Task] = None
+        self.probe_count = 0
+
+    def start(self):
+        # Starts probing in the background. Calling this again while it runs does nothing.
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.probe_due_providers()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] Failed to probe providers. {str(e)}")
+            await asyncio.sleep(self.check_interval)
+
+    async def probe_due_providers(self) -> int:
+        # Probes the providers that have not seen any traffic for a while. Providers with an open breaker are only
+        # probed once their recovery time has passed. Returns the number of probes sent.
+        await self.llm.ensure_providers_loaded()
+        now = time.monotonic()
+        due = [provider for provider in self.llm.providers if provider.working and
+               now - self.llm.last_attempt_times.get(provider.__name__, -self.interval) >= self.interval]
+        semaphore = asyncio.Semaphore(self.max_concurrent_probes)
+
+        async def probe(provider) -> bool:
+            async with semaphore:
+                if not self.llm.breakers.get(provider.__name__).allow_request():
+                    return False
+                # Records the outcome in the breaker and health statistics like any other request
+                await self.llm.request_provider(provider, ProviderProber.PROBE_MESSAGES)
+                return True
+
+        results = await asyncio.gather(*[probe(provider) for provider in due])
+        probed = sum(1 for result in results if result)
+        self.probe_count += probed
+        if probed:
+            self.llm.save_provider_stats()
+        return probed
@@ -0,0 +1,190 @@
+import json
+import math
+import os
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class ProviderStats:
+    EWMA_ALPHA = 0.2  # Weight of the newest observation in the moving averages
+    LATENCY_WINDOW = 200  # Number of recent latencies kept for percentiles
+    PERSISTED_LATENCIES = 50  # Number of recent latencies written to disk
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.invalid = 0
+        self.failures = 0
+        self.ewma_success = 1.0
+        self.ewma_latency = 0.0
+        self.latencies = deque(maxlen=ProviderStats.LATENCY_WINDOW)
+        # TError_Class(str): count(int)
+        self.errors: Dict[str, int] = {}
+        # TSize_Class(str): ProviderStats of the requests with prompts of that size
+        self.size_profiles: Dict[str, ProviderStats] = {}
+
+    def record(self, success: bool, latency: Optional[float], error_class: Optional[str] = None,
+               invalid: bool = False, size_class: Optional[str] = None):
+        if size_class is not None:
+            if size_class not in self.size_profiles:
+                self.size_profiles[size_class] = ProviderStats()
+            self.size_profiles[size_class].record(success, latency, error_class, invalid)
+        self.attempts += 1
+        if success:
+            self.successes += 1
+        elif invalid:
+            self.invalid += 1
+        else:
+            self.failures += 1
+        if error_class is not None:
+            self.errors[error_class] = self.errors.get(error_class, 0) + 1
+
+        self.ewma_success += ProviderStats.EWMA_ALPHA * ((1.0 if success else 0.0) - self.ewma_success)
+        if latency is not None:
+            self.latencies.append(latency)
+            if self.ewma_latency == 0.0:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency += ProviderStats.EWMA_ALPHA * (latency - self.ewma_latency)
+
+    def success_rate(self) -> float:
+        return self.successes / self.attempts if self.attempts else 0.0
+
+    def invalid_rate(self) -> float:
+        return self.invalid / self.attempts if self.attempts else 0.0
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(percentile / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self) -> dict:
+        return {
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "invalid": self.invalid,
+            "failures": self.failures,
+            "ewma_success": self.ewma_success,
+            "ewma_latency": self.ewma_latency,
+            "latencies": list(self.latencies)[-ProviderStats.PERSISTED_LATENCIES:],
+            "errors": dict(self.errors),
+            "sizes": {size_class: profile.to_dict() for size_class, profile in self.size_profiles.items()},
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "ProviderStats":
+        stats = ProviderStats()
+        stats.attempts = int(data.get("attempts", 0))
+        stats.successes = int(data.get("successes", 0))
+        stats.invalid = int(data.get("invalid", 0))
+        stats.failures = int(data.get("failures", 0))
+        stats.ewma_success = float(data.get("ewma_success", 1.0))
+        stats.ewma_latency = float(data.get("ewma_latency", 0.0))
+        stats.latencies.extend(data.get("latencies", []))
+        stats.errors = dict(data.get("errors", {}))
+        stats.size_profiles = {size_class: ProviderStats.from_dict(profile)
+                               for size_class, profile in data.get("sizes", {}).items()}
+        return stats
+
+
+class ProviderHealthRegistry:
+    LATENCY_SCALE = 5.0  # Seconds of latency that halve a provider's score
+    EXPLORATION_WEIGHT = 0.1  # UCB bonus given to rarely attempted providers
+    UNSEEN_PRIOR = 0.5  # Score of a provider that has never been attempted
+    SAVE_INTERVAL = 30.0  # Minimum seconds between writes of the stats file
+    MIN_SIZE_SAMPLES = 5  # Attempts at a prompt size before its own profile is trusted over the overall statistics
+
+    def __init__(self, stats_file_path: Optional[str] = None):
+        self.stats_file_path = stats_file_path
+        # TProvider_Name(str): ProviderStats
+        self.stats: Dict[str, ProviderStats] = {}
+        self.total_attempts = 0
+        self.load()
+
+    def get(self, name: str) -> ProviderStats:
+        if name not in self.stats:
+            self.stats[name] = ProviderStats()
+        return self.stats[name]
+
+    def record_success(self, name: str, latency: float, size_class: Optional[str] = None):
+        self.get(name).record(True, latency, size_class=size_class)
+        self.total_attempts += 1
+
+    def record_invalid(self, name: str, latency: float, size_class: Optional[str] = None):
+        self.get(name).record(False, latency, error_class="InvalidResponse", invalid=True, size_class=size_class)
+        self.total_attempts += 1
+
+    def record_failure(self, name: str, error_class: str, latency: Optional[float] = None,
+                       size_class: Optional[str] = None):
+        self.get(name).record(False, latency, error_class=error_class, size_class=size_class)
+        self.total_attempts += 1
+
+    def score(self, name: str, size_class: Optional[str] = None) -> float:
+        # Expected chance of a usable answer, discounted by how slow the provider is, plus an exploration bonus.
+        # With a size class, the provider is judged on prompts of that size once it has seen enough of them.
+        stats = self.stats.get(name)
+        attempts = stats.attempts if stats is not None else 0
+        if attempts == 0:
+            exploitation = ProviderHealthRegistry.UNSEEN_PRIOR
+        else:
+            profile = stats.size_profiles.get(size_class)
+            if profile is None or profile.attempts < ProviderHealthRegistry.MIN_SIZE_SAMPLES:
+                profile = stats
+            exploitation = profile.ewma_success / (1.0 + profile.ewma_latency / ProviderHealthRegistry.LATENCY_SCALE)
+        exploration = ProviderHealthRegistry.EXPLORATION_WEIGHT * math.sqrt(
+            math.log(self.total_attempts + 1) / (attempts + 1))
+        return exploitation + exploration
+
+    def rank(self, providers: list, size_class: Optional[str] = None) -> list:
+        # Orders providers from healthiest to least healthy. Ties keep the given order.
+        return sorted(providers, key=lambda provider: -self.score(provider.__name__, size_class))
+
+    def summary(self) -> List[dict]:
+        rows = []
+        for name, stats in self.stats.items():
+            if stats.attempts == 0:
+                continue
+            rows.append({
+                "provider": name,
+                "attempts": stats.attempts,
+                "success_rate": stats.success_rate(),
+                "invalid_rate": stats.invalid_rate(),
+                "p50_latency": stats.latency_percentile(50),
+                "p95_latency": stats.latency_percentile(95),
+                "errors": dict(stats.errors),
+                "p50_latency_by_size": {size_class: profile.latency_percentile(50)
+                                        for size_class, profile in stats.size_profiles.items()},
+                "score": self.score(name),
+            })
+        return sorted(rows, key=lambda row: -row["score"])
+
+    def snapshot(self) -> dict:
+        return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+    def load(self):
+        if self.stats_file_path is None or not os.path.exists(self.stats_file_path):
+            return
+        try:
+            with open(self.stats_file_path, "r") as json_file:
+                read_data = json.load(json_file)
+            for name, data in read_data.items():
+                self.stats[name] = ProviderStats.from_dict(data)
+            self.total_attempts = sum(stats.attempts for stats in self.stats.values())
+        except Exception as e:
+            print(f"[ERROR] Failed to read provider stats \"{self.stats_file_path}\" {str(e)}")
+
+    def save(self, snapshot: Optional[dict] = None):
+        # Writes the stats file atomically. Pass a snapshot when calling from another thread.
+        if self.stats_file_path is None:
+            return
+        if snapshot is None:
+            snapshot = self.snapshot()
+        temp_path = self.stats_file_path + ".tmp"
+        try:
+            with open(temp_path, "w") as json_file:
+                json.dump(snapshot, json_file)
+            os.replace(temp_path, self.stats_file_path)
+        except Exception as e:
+            print(f"[ERROR] Failed to write provider stats \"{self.stats_file_path}\" {str(e)}")
@@ -0,0 +1,79 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from utils.Metrics import Metrics
+
+
+class ResponseCache:
+    DEFAULT_TTL = 600.0  # Seconds a cached response stays valid
+    DEFAULT_MAX_ENTRIES = 2048
+    DEFAULT_MAX_BYTES = 8 * 1024 * 1024  # Maximum total size of the cached responses
+    DEFAULT_TAIL_MESSAGES = 3  # Number of most recent prompt messages that make up the key
+
+    WHITESPACE_PATTERN = re.compile(r"\s+")
+    # Trailing punctuation, emoticons and the '[USERNAME]: ' header do not change what is being asked
+    USERNAME_HEADER_PATTERN = re.compile(r"^\[[^]]*]:\s*")
+    TRAILING_PUNCTUATION_PATTERN = re.compile(r"[\s!?.,~]+$")
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, tail_messages: int = DEFAULT_TAIL_MESSAGES,
+                 metrics: Optional[Metrics] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.tail_messages = tail_messages
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        # TKey(str): (expiry time(float), response(str)), least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def create_key(self, role: str, prompt_messages: List[dict]) -> str:
+        # Hashes the role with a normalized tail of the conversation
+        digest = hashlib.sha256(role.encode("utf-8"))
+        for message in prompt_messages[-self.tail_messages:]:
+            digest.update(b"\0" + message["role"].encode("utf-8") + b"\0")
+            digest.update(self.normalize(message["content"]).encode("utf-8"))
+        return digest.hexdigest()
+
+    def normalize(self, content: str) -> str:
+        content = ResponseCache.USERNAME_HEADER_PATTERN.sub("", content)
+        content = ResponseCache.WHITESPACE_PATTERN.sub(" ", content).strip().lower()
+        return ResponseCache.TRAILING_PUNCTUATION_PATTERN.sub("", content)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            # Expired
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            self.metrics.increment("aurora_response_cache_requests_total", result="miss")
+            return None
+        self.hits += 1
+        self.metrics.increment("aurora_response_cache_requests_total", result="hit")
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, response: str):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.total_bytes += len(response)
+
+        # Evicts the least recently used responses once over the limits
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def _remove(self, key: str):
+        self.total_bytes -= len(self.entries.pop(key)[1])
@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+
+
+class RoleStore:
+    DEFAULT_WATCH_INTERVAL = 5.0  # Seconds between two checks of the roles directory for changes
+
+    def __init__(self, roles_path: str, default_role_file: str, default_role: str,
+                 watch_interval: float = DEFAULT_WATCH_INTERVAL):
+        self.roles_path = roles_path
+        self.default_role_file = default_role_file
+        self.default_role = default_role
+        self.watch_interval = watch_interval
+
+        # TContent_Hash(str): role text. Files with the same content share one string.
+        self.texts: Dict[str, str] = {}
+        # TFile_Name(str): (mtime, size, content hash)
+        self.files: Dict[str, Tuple[float, int, str]] = {}
+        # Sorted file names of the roles directory
+        self.listing: List[str] = []
+        self.watch_task: Optional[asyncio.Task] = None
+        self.refresh()
+
+    def get(self, file_name: str) -> str:
+        # Gets the role text of the file, falling back on the default role. Never touches the disk.
+        entry = self.files.get(file_name) or self.files.get(self.default_role_file)
+        return self.texts[entry[2]] if entry is not None else self.default_role
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.files
+
+    def list_roles(self) -> List[str]:
+        return self.listing
+
+    def refresh(self) -> bool:
+        # Reloads the role files whose mtime or size changed. Returns true if anything changed.
+        current = {}
+        try:
+            for entry in os.scandir(self.roles_path):
+                if entry.is_file():
+                    stat = entry.stat()
+                    current[entry.name] = (stat.st_mtime, stat.st_size)
+        except OSError as e:
+            print(f"[ERROR] Failed to scan roles directory. {str(e)}")
+            return False
+
+        files, texts = {}, {}
+        changed = current.keys() != self.files.keys()
+        for name, (mtime, size) in current.items():
+            known = self.files.get(name)
+            if known is not None and known[0] == mtime and known[1] == size:
+                files[name] = known
+                texts[known[2]] = self.texts[known[2]]
+                continue
+            try:
+                with open(os.path.join(self.roles_path, name), "r") as file:
+                    text = file.read()
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"[ERROR] Failed to read role {name}. {str(e)}")
+                continue
+            content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            # Reuses the string that is already held for the same content
+            text = texts.get(content_hash) or self.texts.get(content_hash) or text
+            files[name] = (mtime, size, content_hash)
+            texts[content_hash] = text
+            changed = True
+
+        if changed:
+            # Swapped as a whole so that readers on the event loop never see a partial update
+            self.files, self.texts, self.listing = files, texts, sorted(files)
+        return changed
+
+    def start_watching(self):
+        # Checks the roles directory for changes in the background. Calling this again does nothing.
+        if self.watch_task is None or self.watch_task.done():
+            self.watch_task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"[ERROR] Failed to refresh roles. {str(e)}")
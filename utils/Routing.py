@@ -0,0 +1,71 @@
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class RoutingTable:
+    # Routes prompts by size. The table file is json and every section is optional:
+    #   {
+    #     "size_classes": {"small": 600, "medium": 2000},           upper token bound of each class, larger is "large"
+    #     "models": {"gpt-4": {"max_tokens": 7900}},                 prompt token limit of a g4f model
+    #     "providers": {"You": {"max_tokens": 2000, "model": "gpt-4"}}  limit and model of a provider
+    #   }
+    # A provider's limit is its own max_tokens, else the limit of its model, else the default limit.
+    TABLE_FILE_NAME = "routing.json"
+    DEFAULT_MAX_TOKENS = 3900
+    LARGE_SIZE_CLASS = "large"
+    # (size class, largest prompt in tokens)
+    DEFAULT_SIZE_CLASSES = [("small", 600), ("medium", 2000)]
+
+    def __init__(self, table_file_path: Optional[str] = None, default_max_tokens: int = DEFAULT_MAX_TOKENS):
+        self.table_file_path = table_file_path
+        self.default_max_tokens = default_max_tokens
+        self.size_classes: List[Tuple[str, int]] = list(RoutingTable.DEFAULT_SIZE_CLASSES)
+        # TModel_Name(str): max prompt tokens(int)
+        self.model_max_tokens: Dict[str, int] = {}
+        # TProvider_Name(str): max prompt tokens(int)
+        self.provider_max_tokens: Dict[str, int] = {}
+        # TProvider_Name(str): g4f model name(str)
+        self.provider_models: Dict[str, str] = {}
+        self.load()
+
+    def load(self):
+        if self.table_file_path is None or not os.path.exists(self.table_file_path):
+            return
+        try:
+            with open(self.table_file_path, "r") as json_file:
+                table = json.load(json_file)
+            size_classes = table.get("size_classes")
+            if size_classes:
+                self.size_classes = sorted(((name, int(limit)) for name, limit in size_classes.items()),
+                                           key=lambda size_class: size_class[1])
+            self.model_max_tokens = {name: int(entry["max_tokens"]) for name, entry in table.get("models", {}).items()
+                                     if "max_tokens" in entry}
+            providers = table.get("providers", {})
+            self.provider_max_tokens = {name: int(entry["max_tokens"]) for name, entry in providers.items()
+                                        if "max_tokens" in entry}
+            self.provider_models = {name: str(entry["model"]) for name, entry in providers.items() if "model" in entry}
+        except Exception as e:
+            print(f"[ERROR] Failed to read routing table \"{self.table_file_path}\" {str(e)}")
+
+    def size_class(self, prompt_tokens: Optional[int]) -> Optional[str]:
+        if prompt_tokens is None:
+            return None
+        for name, limit in self.size_classes:
+            if prompt_tokens <= limit:
+                return name
+        return RoutingTable.LARGE_SIZE_CLASS
+
+    def get_model_name(self, provider_name: str) -> Optional[str]:
+        # None means the g4f default model
+        return self.provider_models.get(provider_name)
+
+    def get_max_tokens(self, provider_name: str) -> int:
+        if provider_name in self.provider_max_tokens:
+            return self.provider_max_tokens[provider_name]
+        model_name = self.provider_models.get(provider_name)
+        return self.model_max_tokens.get(model_name, self.default_max_tokens)
+
+    def get_token_budget(self, provider_names: Iterable[str]) -> int:
+        # Largest prompt that at least one of the providers accepts
+        return max((self.get_max_tokens(name) for name in provider_names), default=self.default_max_tokens)
@@ -0,0 +1,64 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import discord
+
+
+class TextSanitizer:
+    USERNAME_PATTERN = re.compile(r"[^a-zA-Z0-9_]")
+    MENTION_PATTERN = re.compile(r"<@!?(\d+)>")
+    # Profile header '[USERNAME]:' at the start of a response, or a mention <@USERNAME> anywhere in it.
+    # A header without the colon is only removed from responses without any ':' and never from a markdown link.
+    RESPONSE_PATTERN = re.compile(r"\A\[[^]]+]:\s*|\A(?=[^:]*\Z)\[[^]]+](?!\()\s*|<@(.*?)>")
+    MAX_CACHED_NAMES = 1000  # Sanitized display names kept per guild
+
+    def __init__(self):
+        # TGuild_ID(int, None for DMs): {TMember_ID(int): (display name, sanitized display name)}
+        self.display_names: Dict[Optional[int], Dict[int, Tuple[str, str]]] = {}
+
+    @staticmethod
+    def sanitize_username(username: str) -> str:
+        # Removes all characters except for alphanumeric and underscores
+        return TextSanitizer.USERNAME_PATTERN.sub("", username)
+
+    def get_display_name(self, guild_id: Optional[int], member) -> str:
+        # Gets the sanitized display name of a member. A name that changed without an update event is sanitized again.
+        names = self.display_names.setdefault(guild_id, {})
+        entry = names.get(member.id)
+        if entry is None or entry[0] != member.display_name:
+            if len(names) >= TextSanitizer.MAX_CACHED_NAMES:
+                names.clear()
+            entry = names[member.id] = (member.display_name, TextSanitizer.sanitize_username(member.display_name))
+        return entry[1]
+
+    def invalidate_member(self, guild_id: Optional[int], member_id: int):
+        names = self.display_names.get(guild_id)
+        if names is not None:
+            names.pop(member_id, None)
+
+    def invalidate_guild(self, guild_id: Optional[int]):
+        self.display_names.pop(guild_id, None)
+
+    def sanitize_message_content(self, content: str, mentions: List, guild_id: Optional[int],
+                                 bot_user_id: int) -> str:
+        # Rewrites every mention in a single pass. Mentions of the bot are removed, other members are replaced by
+        # their sanitized display name.
+        if not mentions:
+            return content
+        replacements = {}
+        for mention in mentions:
+            if mention.id == bot_user_id:
+                replacements[mention.id] = ""
+            else:
+                replacements[mention.id] = f"<@{self.get_display_name(guild_id, mention)}>"
+        return TextSanitizer.MENTION_PATTERN.sub(
+            lambda match: replacements.get(int(match.group(1)), match.group(0)), content)
+
+    @staticmethod
+    def sanitize_bot_response(response: str) -> str:
+        # Removes the profile header and converts mentions <@USERNAME> to USERNAME, in a single pass
+        return TextSanitizer.RESPONSE_PATTERN.sub(lambda match: match.group(1) or "", response)
+
+    @staticmethod
+    def get_guild_id(message: discord.Message) -> Optional[int]:
+        return message.guild.id if message.guild is not None else None
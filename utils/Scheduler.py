@@ -0,0 +1,107 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class ConversationScheduler:
+    DEFAULT_MAX_WORKERS = 8  # Global cap on concurrently serviced conversations
+    DEFAULT_TURN_QUANTUM = 1  # Items a conversation may process before yielding its worker
+    DEFAULT_BATCH_WINDOW = 0.0  # Seconds an idle conversation waits for more items before it is serviced
+
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], max_workers: int = DEFAULT_MAX_WORKERS,
+                 turn_quantum: int = DEFAULT_TURN_QUANTUM, max_batch: Optional[int] = None,
+                 batch_window: float = DEFAULT_BATCH_WINDOW,
+                 batch_key: Optional[Callable[[Any], Hashable]] = None):
+        # Coroutine function that services a single queued item.
+        # With a max_batch, it services a list of up to max_batch consecutive items of the same conversation instead.
+        # Items only share a batch if batch_key gives them the same value.
+        self.handler = handler
+        self.max_workers = max(1, max_workers)
+        self.turn_quantum = max(1, turn_quantum)
+        self.max_batch = max(1, max_batch) if max_batch is not None else None
+        self.batch_window = batch_window
+        self.batch_key = batch_key
+
+        # TConversation_Key(str): deque of items, in arrival order
+        self.pending: Dict[str, deque] = {}
+        # Keys that are waiting for a worker. A key is never in here while a worker owns it.
+        self.ready_keys: Optional[asyncio.Queue] = None
+        # Keys that are either in ready_keys or owned by a worker
+        self.scheduled_keys = set()
+        self.workers = []
+        self.submitted_count = 0
+
+    # Number of items that are waiting to be serviced
+    def queue_depth(self) -> int:
+        return sum(len(items) for items in self.pending.values())
+
+    def submit(self, key: str, item: Any):
+        # Queues the item behind any other work of the same conversation
+        self.pending.setdefault(key, deque()).append(item)
+        self.submitted_count += 1
+
+        # Wakes up a worker if the conversation is not already waiting or being serviced.
+        # When batching, the conversation first waits out the batch window without holding a worker.
+        if key not in self.scheduled_keys:
+            self.scheduled_keys.add(key)
+            if self.max_batch is not None and self.batch_window > 0:
+                asyncio.get_running_loop().call_later(self.batch_window, self._ready_queue().put_nowait, key)
+            else:
+                self._ready_queue().put_nowait(key)
+
+    def start(self):
+        # Spawns the worker pool. Calling this again while workers are alive does nothing.
+        self.workers = [worker for worker in self.workers if not worker.done()]
+        while len(self.workers) < self.max_workers:
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def _ready_queue(self) -> asyncio.Queue:
+        # Created lazily so that the queue binds to the running event loop
+        if self.ready_keys is None:
+            self.ready_keys = asyncio.Queue()
+        return self.ready_keys
+
+    async def _worker(self):
+        ready_keys = self._ready_queue()
+        while True:
+            # Sleeps until a conversation has work for us
+            key = await ready_keys.get()
+            items = self.pending[key]
+
+            # Services a bounded number of items so other conversations get their turn
+            for _ in range(self.turn_quantum):
+                if not items:
+                    break
+                if self.max_batch is not None:
+                    item = self._take_batch(items)
+                else:
+                    item = items.popleft()
+                try:
+                    await self.handler(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] Failed to process queued item for {key}. {str(e)}")
+
+            # Requeues the conversation at the back of the line if there is more to do
+            if items:
+                ready_keys.put_nowait(key)
+            else:
+                del self.pending[key]
+                self.scheduled_keys.discard(key)
+
+    def _take_batch(self, items: deque) -> list:
+        # Takes the consecutive items at the front that belong to the same batch
+        batch = [items.popleft()]
+        first_key = self.batch_key(batch[0]) if self.batch_key is not None else None
+        while items and len(batch) < self.max_batch:
+            if self.batch_key is not None and self.batch_key(items[0]) != first_key:
+                break
+            batch.append(items.popleft())
+        return batch
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+
+class ServerState:
+    def __init__(self, messages: List[dict], metadata: dict):
+        # [{"role": "user", "content": ""},{...},...](list)
+        self.messages = messages
+        # {"selected_role": "default_role.txt", ...}(dict)
+        self.metadata = metadata
+        self.size = 0
+        self.last_access = time.monotonic()
+        self.update_size()
+
+    def update_size(self):
+        # Rough estimate of the memory held by the history
+        self.size = sum(len(message["content"]) for message in self.messages)
+
+
+class ServerStateCache:
+    DEFAULT_MAX_ENTRIES = 1000  # Maximum number of server folders kept in memory
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # Maximum estimated size of all cached histories
+    DEFAULT_IDLE_TTL = 3600.0  # Seconds after which an idle server folder is evicted
+    DEFAULT_SWEEP_INTERVAL = 60.0  # Seconds between two checks for idle server folders
+
+    def __init__(self, can_evict: Callable[[str], bool], max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, idle_ttl: float = DEFAULT_IDLE_TTL):
+        # Tells if the server folder's state was persisted and may be dropped
+        self.can_evict = can_evict
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        # TServer_ID(str): ServerState, least recently used first
+        self.states = OrderedDict()
+        self.total_bytes = 0
+        self.sweep_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __contains__(self, server_folder: str) -> bool:
+        return server_folder in self.states
+
+    def get(self, server_folder: str) -> Optional[ServerState]:
+        state = self.states.get(server_folder)
+        if state is not None:
+            state.last_access = time.monotonic()
+            self.states.move_to_end(server_folder)
+        return state
+
+    def put(self, server_folder: str, state: ServerState):
+        if server_folder in self.states:
+            self.total_bytes -= self.states.pop(server_folder).size
+        self.states[server_folder] = state
+        self.total_bytes += state.size
+        self.evict(keep=server_folder)
+
+    def resize(self, server_folder: str):
+        # Updates the size of a state whose history changed
+        state = self.states[server_folder]
+        self.total_bytes -= state.size
+        state.update_size()
+        self.total_bytes += state.size
+        self.evict(keep=server_folder)
+
+    def evict(self, keep: Optional[str] = None):
+        # Drops the least recently used states that are over the limits or idle. Unpersisted states are kept.
+        now = time.monotonic()
+        for server_folder in list(self.states.keys()):
+            state = self.states[server_folder]
+            over_limits = len(self.states) > self.max_entries or self.total_bytes > self.max_bytes
+            if not over_limits and now - state.last_access < self.idle_ttl:
+                break
+            if server_folder == keep or not self.can_evict(server_folder):
+                continue
+            del self.states[server_folder]
+            self.total_bytes -= state.size
+
+    def start_sweeping(self, interval: float = DEFAULT_SWEEP_INTERVAL):
+        # Evicts idle states in the background, put() only evicts when another server folder is loaded.
+        # Calling this again while it runs does nothing.
+        if self.sweep_task is None or self.sweep_task.done():
+            self.sweep_task = asyncio.create_task(self._sweep(interval))
+
+    async def _sweep(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict()
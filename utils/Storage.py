@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+
+class StorageBackend:
+    # Interface used by BotDataManager to persist each server folder's history and metadata
+
+    def list_server_folders(self) -> List[str]:
+        raise NotImplementedError
+
+    def load_messages(self, server_folder: str) -> Optional[List[dict]]:
+        raise NotImplementedError
+
+    def load_metadata(self, server_folder: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    # Persists the message history. "appended" lists the messages added since the last save, if known.
+    # The backend may use it to avoid rewriting the whole history. None means the history was replaced.
+    def save_messages(self, server_folder: str, messages: List[dict], appended: Optional[List[dict]] = None):
+        raise NotImplementedError
+
+    def save_metadata(self, server_folder: str, metadata: dict):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonStorageBackend(StorageBackend):
+    MESSAGE_CACHE_FILE_NAME = "message_cache.json"
+    METADATA_FILE_NAME = "metadata.json"
+
+    def __init__(self, server_data_path: str):
+        self.server_data_path = server_data_path
+
+    def list_server_folders(self) -> List[str]:
+        return [name for name in os.listdir(self.server_data_path)
+                if os.path.isdir(os.path.join(self.server_data_path, name))]
+
+    def load_messages(self, server_folder: str) -> Optional[List[dict]]:
+        return self._read_json(server_folder, JsonStorageBackend.MESSAGE_CACHE_FILE_NAME)
+
+    def load_metadata(self, server_folder: str) -> Optional[dict]:
+        return self._read_json(server_folder, JsonStorageBackend.METADATA_FILE_NAME)
+
+    def save_messages(self, server_folder: str, messages: List[dict], appended: Optional[List[dict]] = None):
+        # The json layout can only be rewritten as a whole
+        self._write_json(server_folder, JsonStorageBackend.MESSAGE_CACHE_FILE_NAME, messages)
+
+    def save_metadata(self, server_folder: str, metadata: dict):
+        self._write_json(server_folder, JsonStorageBackend.METADATA_FILE_NAME, metadata)
+
+    def _read_json(self, server_folder: str, name: str):
+        path = os.path.join(self.server_data_path, server_folder, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as json_file:
+            # Read and parse data from the file
+            try:
+                return json.load(json_file)
+            except Exception as e:
+                print(f"[ERROR] Failed to read in json file \"{name}\" {str(e)}")
+                return None
+
+    def _write_json(self, server_folder: str, name: str, data):
+        # If server folder hasn't been created yet, create one.
+        os.makedirs(os.path.join(self.server_data_path, server_folder), exist_ok=True)
+
+        # Writes to a temporary file first so that a crash mid-write never leaves a torn file behind
+        path = os.path.join(self.server_data_path, server_folder, name)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as json_file:
+            json.dump(data, json_file, indent=4)
+        os.replace(temp_path, path)
+
+
+class SQLiteStorageBackend(StorageBackend):
+    DATABASE_FILE_NAME = "server_data.sqlite3"
+    JSON_MIGRATION_KEY = "migrated_from_json"
+    BUSY_TIMEOUT = 60.0  # Seconds to wait for another process that holds the write lock, ex: while it migrates
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        # The connection is shared with persistence threads, so every access goes through the lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(database_path, timeout=SQLiteStorageBackend.BUSY_TIMEOUT,
+                                          check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS messages ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, server_folder TEXT NOT NULL, "
+                    "role TEXT NOT NULL, content TEXT NOT NULL, token_count INTEGER)")
+                self.connection.execute(
+                    "CREATE INDEX IF NOT EXISTS messages_by_server_folder ON messages (server_folder, id)")
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS metadata (server_folder TEXT PRIMARY KEY, data TEXT NOT NULL)")
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS storage_info (key TEXT PRIMARY KEY, value TEXT)")
+
+    def list_server_folders(self) -> List[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT server_folder FROM metadata UNION SELECT DISTINCT server_folder FROM messages").fetchall()
+        return [row[0] for row in rows]
+
+    def load_messages(self, server_folder: str) -> Optional[List[dict]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT role, content, token_count FROM messages WHERE server_folder = ? ORDER BY id",
+                (server_folder,)).fetchall()
+        if not rows:
+            return None
+        return [self._row_to_message(row) for row in rows]
+
+    def load_metadata(self, server_folder: str) -> Optional[dict]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM metadata WHERE server_folder = ?", (server_folder,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def save_messages(self, server_folder: str, messages: List[dict], appended: Optional[List[dict]] = None):
+        with self.lock, self.connection:
+            if appended is None:
+                # History was replaced, rewrite it
+                self._replace_messages(server_folder, messages)
+                return
+
+            # Appends the new rows, then drops the rows that were trimmed from the front of the history
+            self._insert_messages(server_folder, appended)
+            if len(messages) == 0:
+                self.connection.execute("DELETE FROM messages WHERE server_folder = ?", (server_folder,))
+            else:
+                self.connection.execute(
+                    "DELETE FROM messages WHERE server_folder = ? AND id < ("
+                    "SELECT id FROM messages WHERE server_folder = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (server_folder, server_folder, len(messages) - 1))
+
+    def save_metadata(self, server_folder: str, metadata: dict):
+        with self.lock, self.connection:
+            self._upsert_metadata(server_folder, metadata)
+
+    def migrate_from(self, source: StorageBackend) -> int:
+        # One-shot import of another backend's data. Returns the number of migrated server folders.
+        # The check and the import are one write transaction, so when several gateway processes start at the same
+        # time, one of them migrates and the others wait and then find the marker.
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT value FROM storage_info WHERE key = ?",
+                    (SQLiteStorageBackend.JSON_MIGRATION_KEY,)).fetchone()
+                if row is not None:
+                    self.connection.rollback()
+                    return 0
+
+                server_folders = source.list_server_folders()
+                for server_folder in server_folders:
+                    messages = source.load_messages(server_folder)
+                    metadata = source.load_metadata(server_folder)
+                    if messages is not None:
+                        self._replace_messages(server_folder, messages)
+                    if metadata is not None:
+                        self._upsert_metadata(server_folder, metadata)
+                self.connection.execute("INSERT INTO storage_info (key, value) VALUES (?, ?)",
+                                        (SQLiteStorageBackend.JSON_MIGRATION_KEY, str(len(server_folders))))
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+        return len(server_folders)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _replace_messages(self, server_folder: str, messages: List[dict]):
+        self.connection.execute("DELETE FROM messages WHERE server_folder = ?", (server_folder,))
+        self._insert_messages(server_folder, messages)
+
+    def _upsert_metadata(self, server_folder: str, metadata: dict):
+        self.connection.execute(
+            "INSERT INTO metadata (server_folder, data) VALUES (?, ?) "
+            "ON CONFLICT(server_folder) DO UPDATE SET data = excluded.data",
+            (server_folder, json.dumps(metadata)))
+
+    def _insert_messages(self, server_folder: str, messages: List[dict]):
+        self.connection.executemany(
+            "INSERT INTO messages (server_folder, role, content, token_count) VALUES (?, ?, ?, ?)",
+            [(server_folder, message["role"], message["content"], message.get("token_count"))
+             for message in messages])
+
+    @staticmethod
+    def _row_to_message(row) -> dict:
+        message = {"role": row[0], "content": row[1]}
+        if row[2] is not None:
+            message["token_count"] = row[2]
+        return message
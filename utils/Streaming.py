@@ -0,0 +1,83 @@
+import time
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+from utils.Chunking import MESSAGE_LENGTH_LIMIT, split_response
+
+
+class ProgressiveMessage:
+    EDIT_INTERVAL = 1.5  # Seconds between edits, keeps well below discord's message edit rate limit
+    MIN_INITIAL_LENGTH = 40  # Characters buffered before posting, so that invalid responses are caught early
+
+    def __init__(self, send: Callable[[str], Awaitable[Optional[discord.Message]]],
+                 send_continuation: Callable[[str], Awaitable[Optional[discord.Message]]],
+                 send_attachment: Callable[[str], Awaitable[Optional[discord.Message]]],
+                 max_messages: int, edit_interval: float = EDIT_INTERVAL,
+                 min_initial_length: int = MIN_INITIAL_LENGTH):
+        # Posts the initial message and returns it
+        self.send = send
+        # Posts a follow-up part of a long text
+        self.send_continuation = send_continuation
+        # Posts a whole text as a file, for texts that would take more than max_messages messages
+        self.send_attachment = send_attachment
+        self.max_messages = max_messages
+        self.edit_interval = edit_interval
+        self.min_initial_length = min_initial_length
+        self.sent_message: Optional[discord.Message] = None
+        self.posted = False
+        self.shown_text = ""
+        self.last_edit_time = 0.0
+
+    async def update(self, text: str):
+        # Shows the partial text, posting the message first and then editing it at a limited rate.
+        # Text over the length limit is cut off until the response is finished.
+        if len(text) > MESSAGE_LENGTH_LIMIT:
+            text = text[:MESSAGE_LENGTH_LIMIT - 1] + "…"
+        if not self.posted:
+            if len(text) < self.min_initial_length:
+                return
+            await self._post(text)
+        elif self.sent_message is not None and text != self.shown_text:
+            if time.monotonic() - self.last_edit_time >= self.edit_interval:
+                await self._edit(text)
+
+    async def finish(self, text: str):
+        # Shows the complete text. A long text continues in follow-up messages.
+        if self.sent_message is None:
+            await self._post(text)
+            return
+        chunks = split_response(text)
+        if chunks[0] != self.shown_text:
+            await self._edit(chunks[0])
+        if len(chunks) > self.max_messages:
+            # Too long to read as messages, the first part stays shown and the whole text is attached
+            await self.send_attachment(text)
+            return
+        for chunk in chunks[1:]:
+            if await self.send_continuation(chunk) is None:
+                break
+
+    async def abort(self):
+        # Removes the partial message when no response could be generated
+        if self.sent_message is None:
+            return
+        try:
+            await self.sent_message.delete()
+        except Exception as e:
+            print(f"[ERROR] Failed to delete message. {str(e)}")
+        self.sent_message = None
+
+    async def _post(self, text: str):
+        self.posted = True
+        self.sent_message = await self.send(text)
+        self.shown_text = text
+        self.last_edit_time = time.monotonic()
+
+    async def _edit(self, text: str):
+        try:
+            await self.sent_message.edit(content=text)
+            self.shown_text = text
+        except Exception as e:
+            print(f"[ERROR] Failed to edit message. {str(e)}")
+        self.last_edit_time = time.monotonic()
@@ -0,0 +1,134 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from utils.LLM import LLM
+
+
+class ConversationSummarizer:
+    SUMMARY_KEY = "conversation_summary"  # Metadata key under which the running summary is stored
+    SUMMARY_TOKENS_KEY = "conversation_summary_tokens"  # Metadata key of the summary message's token count
+    MAX_SUMMARY_TOKENS = 300  # Longer summaries are cut, a runaway one must not crowd the conversation out
+    DEFAULT_TRIGGER_TOKENS = 2400  # History size that makes the conversation eligible for compaction
+    DEFAULT_TARGET_TOKENS = 1200  # History size left after compaction
+    DEFAULT_IDLE_DELAY = 20.0  # Seconds a conversation has to be idle before it gets compacted
+    MAX_CONCURRENT_SUMMARIES = 2
+
+    SUMMARY_INSTRUCTIONS = ("You maintain the memory of a group chat. Merge the previous summary and the new messages "
+                            "into one updated summary of at most 120 words. Keep names, facts, preferences and open "
+                            "questions. Reply with the summary only.")
+    SUMMARY_HEADER = "Summary of the earlier conversation: "
+
+    def __init__(self, data, llm: LLM, trigger_tokens: int = DEFAULT_TRIGGER_TOKENS,
+                 target_tokens: int = DEFAULT_TARGET_TOKENS, idle_delay: float = DEFAULT_IDLE_DELAY):
+        # BotDataManager that holds the conversations
+        self.data = data
+        self.llm = llm
+        self.trigger_tokens = trigger_tokens
+        self.target_tokens = target_tokens
+        self.idle_delay = idle_delay
+        # TServer_ID(str): pending compaction task
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    # Gets the summary as a message that is placed right after the system role
+    def get_summary_message(self, server_folder: str) -> Optional[dict]:
+        summary = self.data.get_server_state(server_folder).metadata.get(ConversationSummarizer.SUMMARY_KEY)
+        if not summary:
+            return None
+        return {"role": "system", "content": ConversationSummarizer.SUMMARY_HEADER + summary}
+
+    # Gets the token count of the summary message. Summaries are unique per conversation, so the count is stored
+    # next to the summary instead of going through the role token cache.
+    async def get_summary_token_count(self, server_folder: str) -> int:
+        metadata = self.data.get_server_state(server_folder).metadata
+        if ConversationSummarizer.SUMMARY_TOKENS_KEY not in metadata:
+            # Summary written by an older version
+            summary_message = self.get_summary_message(server_folder)
+            if summary_message is None:
+                return 0
+            metadata[ConversationSummarizer.SUMMARY_TOKENS_KEY] = await self.llm.count_tokens_async(
+                summary_message["content"])
+            self.data.update_metadata_file(server_folder)
+        return metadata[ConversationSummarizer.SUMMARY_TOKENS_KEY]
+
+    def clear(self, server_folder: str):
+        self.cancel(server_folder)
+        metadata = self.data.get_server_state(server_folder).metadata
+        if ConversationSummarizer.SUMMARY_KEY in metadata:
+            del metadata[ConversationSummarizer.SUMMARY_KEY]
+            metadata.pop(ConversationSummarizer.SUMMARY_TOKENS_KEY, None)
+            self.data.update_metadata_file(server_folder)
+
+    def cancel(self, server_folder: str):
+        task = self.tasks.pop(server_folder, None)
+        if task is not None:
+            task.cancel()
+
+    def schedule(self, server_folder: str):
+        # (Re)starts the idle timer of the conversation. Compaction only runs once the conversation goes quiet.
+        history = self.data.get_messages(server_folder)
+        if sum(message.get(LLM.TOKEN_COUNT_KEY, 0) for message in history) <= self.trigger_tokens:
+            return
+        self.cancel(server_folder)
+        self.tasks[server_folder] = asyncio.create_task(self._compact_when_idle(server_folder))
+
+    async def _compact_when_idle(self, server_folder: str):
+        try:
+            await asyncio.sleep(self.idle_delay)
+            if self.semaphore is None:
+                self.semaphore = asyncio.Semaphore(ConversationSummarizer.MAX_CONCURRENT_SUMMARIES)
+            async with self.semaphore:
+                await self.compact(server_folder)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[ERROR] Failed to summarize {server_folder}. {str(e)}")
+        finally:
+            if self.tasks.get(server_folder) is asyncio.current_task():
+                del self.tasks[server_folder]
+
+    async def compact(self, server_folder: str) -> bool:
+        # Folds the oldest messages into the running summary and removes them from the history
+        history = self.data.get_messages(server_folder)
+        await self.llm.ensure_token_counts(history)
+        total = sum(message[LLM.TOKEN_COUNT_KEY] for message in history)
+        if total <= self.trigger_tokens:
+            return False
+
+        fold_count = 0
+        while fold_count < len(history) - 1 and total > self.target_tokens:
+            total -= history[fold_count][LLM.TOKEN_COUNT_KEY]
+            fold_count += 1
+        folded = history[:fold_count]
+        if not folded:
+            return False
+
+        previous_summary = self.data.get_server_state(server_folder).metadata.get(ConversationSummarizer.SUMMARY_KEY, "")
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in folded)
+        summary = await self.llm.LLM_get_response([
+            {"role": "system", "content": ConversationSummarizer.SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": f"Previous summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+        ])
+        if summary is None:
+            return False
+        summary, summary_tokens = await asyncio.to_thread(self.truncate_summary, summary.strip())
+
+        # The conversation may have changed while the summary was generated, only drops what is still at the front
+        state = self.data.get_server_state(server_folder)
+        current = state.messages
+        if len(current) < fold_count or any(current[index] is not folded[index] for index in range(fold_count)):
+            return False
+        state.metadata[ConversationSummarizer.SUMMARY_KEY] = summary
+        state.metadata[ConversationSummarizer.SUMMARY_TOKENS_KEY] = summary_tokens
+        self.data.set_messages(server_folder, current[fold_count:])
+        self.data.update_messages_file(server_folder, appended=[])
+        self.data.update_metadata_file(server_folder)
+        print(f"[SYSTEM] Summarized {fold_count} messages of {server_folder}.")
+        return True
+
+    # Cuts the summary to MAX_SUMMARY_TOKENS. Returns the summary and the token count of its message.
+    def truncate_summary(self, summary: str) -> Tuple[str, int]:
+        tokens = self.llm.tokenizer.encode(summary)
+        if len(tokens) > ConversationSummarizer.MAX_SUMMARY_TOKENS:
+            summary = self.llm.tokenizer.decode(tokens[:ConversationSummarizer.MAX_SUMMARY_TOKENS]).rstrip() + "…"
+        return summary, self.llm.count_tokens(ConversationSummarizer.SUMMARY_HEADER + summary)